@@ -1,32 +1,145 @@
 import os
 import time
 import json
-import copy
 import logging
 import functools
+import contextlib
+import collections
+from leaguedirector import codec
 from leaguedirector.widgets import userpath
+from leaguedirector.interpolation import Curve
+from leaguedirector.history import History
+from leaguedirector.track import Track
+from leaguedirector.rules import evaluate
+from leaguedirector.storage import Journal, BinarySequence, atomicWrite, writeBinary
 from PySide6.QtCore import *
 from PySide6.QtNetwork import *
 
 
+class Endpoint(QObject):
+    """
+    A replay api to talk to, usually one game client. Every resource of the
+    same endpoint shares its network manager and connection state, and
+    reports each request so the endpoint can tell how healthy it is.
+    """
+    defaultHost = 'https://127.0.0.1:2999'
+    instance    = None
+    certificates = False
+    samples     = 200
+
+    def __init__(self, host=None):
+        QObject.__init__(self)
+        self.host = host or self.defaultHost
+        self.network = None
+        self.connected = False
+        self.requests = 0
+        self.errors = 0
+        self.sent = 0
+        self.received = 0
+        self.latencies = collections.deque(maxlen=self.samples)
+        self.lastError = None
+        self.lastReply = None
+        self.started = time.time()
+
+    @classmethod
+    def default(cls):
+        """
+        Endpoint of resources that are not given one, the local game.
+        """
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def sslErrors(self, response, errors):
+        allowed = [QSslError.CertificateUntrusted, QSslError.HostNameMismatch]
+        response.ignoreSslErrors([e for e in errors if e.error() in allowed])
+
+    def manager(self):
+        if not Endpoint.certificates:
+            # QT does not ship SSL binaries so we have to bundle them in our res directory
+            os.environ['PATH'] = os.path.abspath('resources') + os.pathsep + os.environ['PATH']
+
+            # Then setup our certificate for the lol game client
+            configuration = QSslConfiguration.defaultConfiguration()
+            configuration.addCaCertificates(QSslCertificate.fromPath(os.path.abspath('resources/riotgames.pem')))
+            QSslConfiguration.setDefaultConfiguration(configuration)
+            Endpoint.certificates = True
+        if self.network is None:
+            self.network = QNetworkAccessManager(QCoreApplication.instance())
+            self.network.sslErrors.connect(self.sslErrors)
+        return self.network
+
+    def record(self, elapsed, sent, received, error=None):
+        self.requests += 1
+        self.sent += sent
+        self.received += received
+        if error is None:
+            self.latencies.append(elapsed)
+            self.lastReply = time.time()
+        else:
+            self.errors += 1
+            self.lastError = error
+
+    def health(self):
+        """
+        Summary of the requests made so far, latencies cover the most
+        recent replies only.
+        """
+        elapsed = max(time.time() - self.started, 0.001)
+        latencies = sorted(self.latencies)
+        def latency(percent):
+            if latencies:
+                return round(latencies[min(int(len(latencies) * percent), len(latencies) - 1)] * 1000, 2)
+        return {
+            'host': self.host,
+            'connected': self.connected,
+            'requests': self.requests,
+            'errors': self.errors,
+            'errorRate': round(self.errors / self.requests, 4) if self.requests else 0.0,
+            'requestRate': round(self.requests / elapsed, 2),
+            'p50': latency(0.5),
+            'p99': latency(0.99),
+            'sentRate': round(self.sent / elapsed, 1),
+            'receivedRate': round(self.received / elapsed, 1),
+            'lastReply': round(time.time() - self.lastReply, 3) if self.lastReply else None,
+            'lastError': self.lastError,
+        }
+
+
 class Resource(QObject):
     """
     Base class for a remote api resources.
     """
     updated     = Signal()
-    host        = 'https://127.0.0.1:2999'
+    fieldsChanged = Signal(set)
     url         = ''
     fields      = {}
-    connected   = False
     readonly    = False
     writeonly   = False
-    network     = None
+    interval    = 500
+    backoff     = 4000
+    timeout     = 5000
 
-    def __init__(self):
+    def __init__(self, endpoint=None):
         super(Resource, self).__setattr__('timestamp', time.time())
         for name, default in self.fields.items():
             super(Resource, self).__setattr__(name, default)
         QObject.__init__(self)
+        self.endpoint = endpoint or Endpoint.default()
+        self.requests = {}
+        self.pending = None
+        self.reading = None
+        self.writing = None
+        self.requestId = 0
+        self.appliedId = 0
+        self.writtenId = 0
+        self.flushTimer = QTimer()
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.timeout.connect(self.flush)
+        self.failures = 0
+        self.pollTimer = QTimer()
+        self.pollTimer.setSingleShot(True)
+        self.pollTimer.timeout.connect(self.poll)
 
     def __setattr__(self, name, value):
         if name in self.fields:
@@ -34,26 +147,21 @@ class Resource(QObject):
                 raise AttributeError("Resource is readonly")
             if getattr(self, name) != value:
                 super(Resource, self).__setattr__(name, value)
-                self.update({name: value})
+                self.write({name: value})
+                self.fieldsChanged.emit({name})
         else:
             super(Resource, self).__setattr__(name, value)
 
-    def sslErrors(self, response, errors):
-        allowed = [QSslError.CertificateUntrusted, QSslError.HostNameMismatch]
-        response.ignoreSslErrors([e for e in errors if e.error() in allowed])
+    @property
+    def host(self):
+        return self.endpoint.host
 
-    def manager(self):
-        if Resource.network is None:
-            # QT does not ship SSL binaries so we have to bundle them in our res directory
-            os.environ['PATH'] = os.path.abspath('resources') + os.pathsep + os.environ['PATH']
+    @property
+    def connected(self):
+        return self.endpoint.connected
 
-            # Then setup our certificate for the lol game client
-            configuration = QSslConfiguration.defaultConfiguration()
-            configuration.addCaCertificates(QSslCertificate.fromPath(os.path.abspath('resources/riotgames.pem')))
-            QSslConfiguration.setDefaultConfiguration(configuration)
-            Resource.network = QNetworkAccessManager(QCoreApplication.instance())
-            Resource.network.sslErrors.connect(self.sslErrors)
-        return Resource.network
+    def manager(self):
+        return self.endpoint.manager()
 
     def set(self, name, value):
         self.__setattr__(name, value)
@@ -62,7 +170,26 @@ class Resource(QObject):
         return getattr(self, name)
 
     def shutdown(self):
-        pass
+        self.stopPolling()
+
+    def pollInterval(self):
+        """
+        Milliseconds to wait before polling this resource again. Polling
+        backs off exponentially while the game is not reachable.
+        """
+        if self.failures:
+            return min(self.interval * 2 ** self.failures, self.backoff)
+        return self.interval
+
+    def poll(self):
+        self.update()
+        self.pollTimer.start(self.pollInterval())
+
+    def startPolling(self):
+        self.poll()
+
+    def stopPolling(self):
+        self.pollTimer.stop()
 
     def data(self):
         return {name: getattr(self, name) for name in self.fields}
@@ -70,38 +197,128 @@ class Resource(QObject):
     def keys(self):
         return list(self.fields)
 
+    def write(self, data):
+        """
+        Queue fields to be posted. Everything written during the same pass
+        of the event loop is merged and sent as a single request.
+        """
+        self.pending = self.merge(self.pending, data)
+        self.flushTimer.start(0)
+
+    def merge(self, queued, data):
+        """
+        Combine a queued write with a newer one, newer values win.
+        """
+        if queued is None:
+            return dict(data)
+        return dict(queued, **data)
+
+    def flush(self):
+        if self.pending is not None and self.writing is None:
+            data, self.pending = self.pending, None
+            Resource.update(self, data)
+
     def update(self, data=None):
+        if data is None:
+            # Only ever keep one poll in flight, a second one would just
+            # come back with the same state
+            if self.reading is not None:
+                return self.reading
+        else:
+            if self.pending is not None:
+                data = self.merge(self.pending, data)
+                self.pending = None
+                self.flushTimer.stop()
+            if self.writing is not None:
+                # Hold the write back until the previous one has landed,
+                # anything written in the meantime supersedes it
+                self.pending = data
+                return self.writing
+        self.requestId += 1
         request = QNetworkRequest(QUrl(self.host + self.url))
+        request.setTransferTimeout(self.timeout)
         if data is not None:
             request.setHeader(QNetworkRequest.ContentTypeHeader, "application/json")
-            response = self.manager().post(request, QByteArray(json.dumps(data).encode()))
+            body = data if isinstance(data, bytes) else codec.encode(data)
+            response = self.manager().post(request, QByteArray(body))
+            self.writing = response
+            self.writtenId = self.requestId
+            self.requests[self.requestId] = (time.perf_counter(), len(body))
         else:
             response = self.manager().get(request)
-        response.finished.connect(functools.partial(self.finished, response))
-
-    def finished(self, response):
+            self.reading = response
+            self.requests[self.requestId] = (time.perf_counter(), 0)
+        response.finished.connect(functools.partial(self.finished, response, self.requestId))
+        return response
+
+    def finished(self, response, requestId):
+        write = response is self.writing
+        if response is self.reading:
+            self.reading = None
+        if response is self.writing:
+            self.writing = None
+        endpoint = self.endpoint
+        connected = endpoint.connected
+        failing = bool(self.failures)
+        changed = set()
+        received = 0
         error = response.error()
         if error == QNetworkReply.NoError:
-            Resource.connected = True
-            self.apply(json.loads(response.readAll().data().decode()))
-            self.timestamp = time.time()
-        elif error in (QNetworkReply.ConnectionRefusedError, QNetworkReply.TimeoutError):
-            Resource.connected = False
+            endpoint.connected = True
+            self.failures = 0
+            body = response.readAll()
+            received = body.size()
+            # Replies can overtake each other, anything older than the last
+            # state we applied or than our last write is stale
+            if requestId > self.appliedId and requestId >= self.writtenId:
+                self.appliedId = requestId
+                changed = self.apply(codec.decode(body))
+                self.timestamp = time.time()
+        elif error in (QNetworkReply.ConnectionRefusedError, QNetworkReply.TimeoutError, QNetworkReply.OperationCanceledError):
+            endpoint.connected = False
+            self.failures += 1
         else:
             logging.error("Request Failed: {} {}".format(self.url, response.errorString()))
-        self.updated.emit()
+        started, sent = self.requests.pop(requestId, (time.perf_counter(), 0))
+        endpoint.record(time.perf_counter() - started, sent, received, None if error == QNetworkReply.NoError else response.errorString())
+        response.deleteLater()
+        self.flush()
+        self.reschedule()
+        if changed:
+            self.fieldsChanged.emit(changed)
+        # A poll that found nothing new is not worth waking the ui for
+        if changed or write or connected != endpoint.connected or failing != bool(self.failures):
+            self.updated.emit()
+
+    def reschedule(self):
+        # Poll sooner if the new state asks for a faster rate than the one
+        # the pending poll was scheduled with
+        if self.pollTimer.isActive():
+            interval = self.pollInterval()
+            if self.pollTimer.remainingTime() > interval:
+                self.pollTimer.start(interval)
 
     def apply(self, data):
+        """
+        Take over the state the game sent and return the names of the
+        fields that changed.
+        """
+        changed = set()
         if not self.writeonly:
             for key, value in data.items():
-                if key in self.fields:
-                    super(Resource, self).__setattr__(key, value)
+                if key in self.fields and (self.pending is None or key not in self.pending):
+                    if getattr(self, key) != value:
+                        super(Resource, self).__setattr__(key, value)
+                        changed.add(key)
+        return changed
 
 
 class Game(Resource):
     url = '/replay/game'
     fields = {'processID': 0}
     readonly = True
+    interval = 2000
+    backoff = 2000
 
 
 class Recording(Resource):
@@ -120,9 +337,15 @@ class Recording(Resource):
         'replaySpeed': 0,
     }
 
+    def pollInterval(self):
+        if self.recording and not self.failures:
+            return 250
+        return max(Resource.pollInterval(self), 1000)
+
 
 class Render(Resource):
     url = '/replay/render'
+    captureInterval = 33
     fields = {
         'cameraLockX': False,
         'cameraLockY': False,
@@ -190,16 +413,31 @@ class Render(Resource):
         'depthOfFieldFar' : 0,
     }
 
-    def __init__(self):
-        Resource.__init__(self)
+    def __init__(self, endpoint=None):
+        Resource.__init__(self, endpoint)
         self.cameraMoveBackX = None
         self.cameraMoveBackY = None
         self.cameraMoveBackZ = None
         self.cameraMoveBackLast = None
+        self.moving = False
+        self.capturing = False
         self.timer = QTimer()
         self.timer.timeout.connect(self.updateCameraMoveBack)
         self.timer.start(600)
 
+    def pollInterval(self):
+        # Follow the camera closely while it is being flown around
+        if self.capturing and not self.failures:
+            return self.captureInterval
+        if self.moving and not self.failures:
+            return 100
+        return Resource.pollInterval(self)
+
+    def apply(self, data):
+        changed = Resource.apply(self, data)
+        self.moving = 'cameraPosition' in changed or 'cameraRotation' in changed
+        return changed
+
     def updateCameraMoveBack(self, *args):
         # Wait until the camera stops moving before snapping it
         if self.cameraMoveBackLast != self.cameraPosition:
@@ -242,9 +480,34 @@ class Particles(Resource):
     url = '/replay/particles'
     fields = {}
     particles = {}
+    interval = 2000
+
+    def __init__(self, endpoint=None):
+        Resource.__init__(self, endpoint)
+        self.rules = []
 
     def apply(self, data):
+        # Particles are not fields, report the particles that changed instead
+        if self.pending:
+            data = dict(data, **{name: enabled for name, enabled in self.pending.items() if name in data})
+        changed = set(name for name, enabled in data.items() if self.particles.get(name) != enabled)
+        changed.update(name for name in self.particles if name not in data)
+        appeared = [name for name in data if name not in self.particles]
         self.particles = data
+        self.applyRules(appeared)
+        return changed
+
+    def setRules(self, rules):
+        """
+        Keep the given rules applied, to the current particles right away
+        and to any particle that shows up later.
+        """
+        self.rules = list(rules)
+        self.applyRules(self.particles)
+
+    def applyRules(self, names):
+        if self.rules and names:
+            self.setParticles(evaluate(self.rules, names))
 
     def items(self):
         return self.particles.items()
@@ -253,8 +516,17 @@ class Particles(Resource):
         return particle in self.particles
 
     def setParticle(self, particle, enabled):
-        if particle in self.particles:
-            self.update({particle:enabled})
+        self.setParticles({particle: enabled})
+
+    def setParticles(self, particles):
+        """
+        Enable or disable many particles with a single request.
+        """
+        particles = {name: enabled for name, enabled in particles.items() if name in self.particles and self.particles[name] != enabled}
+        if particles:
+            self.particles = dict(self.particles, **particles)
+            self.write(particles)
+            self.fieldsChanged.emit(set(particles))
 
     def getParticle(self, particle):
         return self.particles.get(particle, True)
@@ -270,6 +542,11 @@ class Playback(Resource):
         'length':   1.0,
     }
 
+    def pollInterval(self):
+        if (self.seeking or not self.paused) and not self.failures:
+            return 100
+        return Resource.pollInterval(self)
+
     @property
     def currentTime(self):
         if self.paused:
@@ -311,8 +588,12 @@ class Sequence(Resource):
     namesLoaded = Signal()
     url = '/replay/sequence'
     writeonly = True
-    history = []
-    history_index = 0
+    historyLimit = 200000
+    journalLimit = 64 * 1024
+    # The game replaces its whole sequence on every post, only turn this on
+    # with setPartialUpload against a client that merges the tracks it is sent
+    partialUpload = False
+    extensions = {'json': '.json', 'binary': '.ldseq'}
     fields = {
         'playbackSpeed': [],
         'cameraPosition': [],
@@ -380,13 +661,28 @@ class Sequence(Resource):
     ]
 
     def __init__(self, render, playback):
-        Resource.__init__(self)
+        Resource.__init__(self, playback.endpoint)
+        for name in self.fields:
+            super(Resource, self).__setattr__(name, Track())
         self.render = render
         self.playback = playback
         self.name = ''
         self.names = []
         self.directory = None
+        self.format = 'json'
+        self.snapshot = None
+        self.unloaded = set()
         self.sequencing = False
+        self.history = History(self.historyLimit)
+        self.dirtyHistory = set()
+        self.dirtyFile = set()
+        self.dirtyRemote = set(self.fields)
+        self.encoded = {}
+        self.synced = False
+        self.online = False
+        self.transactions = 0
+        self.edited = False
+        self.deferred = False
         self.saveRemoteTimer = QTimer()
         self.saveRemoteTimer.timeout.connect(self.saveRemoteNow)
         self.saveRemoteTimer.setSingleShot(True)
@@ -396,29 +692,100 @@ class Sequence(Resource):
         self.saveFileTimer = QTimer()
         self.saveFileTimer.timeout.connect(self.saveFileNow)
         self.saveFileTimer.setSingleShot(True)
+        self.playback.updated.connect(self.checkConnection)
+
+    def update(self, *names):
+        """
+        Called after the keyframes of the named tracks changed, or of every
+        track when no names are given.
+        """
+        self.dirtyHistory.update(names or self.fields)
+        self.dirtyFile.update(names or self.fields)
+        self.dirtyRemote.update(names or self.fields)
+        if self.transactions:
+            self.edited = True
+        else:
+            self.saveRemote()
+            self.saveFile()
+            self.saveHistory()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group many keyframe edits into one. Changes made inside are pushed,
+        saved and recorded in the undo history once, when the outermost
+        transaction ends. A transaction that changed nothing saves nothing,
+        even when an earlier edit is still waiting to be saved.
+        """
+        if not self.transactions:
+            self.edited = False
+        self.transactions += 1
+        try:
+            yield self
+        finally:
+            self.transactions -= 1
+            if not self.transactions and self.edited:
+                self.edited = False
+                self.saveRemote()
+                self.saveFile()
+                self.saveHistory()
 
-    def update(self, *args):
-        self.saveRemote()
-        self.saveFile()
-        self.saveHistory()
+    def merge(self, queued, data):
+        # Every upload carries the whole sequence so a newer one replaces it
+        return data
 
     def data(self):
-        return {key:getattr(self, key) for key in self.fields}
+        return {key:self.getKeyframes(key) for key in self.fields}
+
+    def bounds(self, name):
+        if name in self.unloaded:
+            return self.snapshot.bounds(name)
+        keyframes = self.getKeyframes(name)
+        if len(keyframes):
+            return keyframes.start, keyframes.end
 
     @property
     def startTime(self):
-        keyframes = self.cameraPosition + self.cameraRotation
-        if len(keyframes):
-            return min(keyframe['time'] for keyframe in keyframes)            
+        bounds = [self.bounds(name) for name in ('cameraPosition', 'cameraRotation')]
+        bounds = [start for start, end in filter(None, bounds)]
+        if bounds:
+            return min(bounds)
 
     @property
     def endTime(self):
-        keyframes = self.cameraPosition + self.cameraRotation
-        if len(keyframes):
-            return max(keyframe['time'] for keyframe in keyframes)            
-
-    def path(self):
-        return os.path.join(self.directory, self.name + '.json')
+        bounds = [self.bounds(name) for name in ('cameraPosition', 'cameraRotation')]
+        bounds = [end for start, end in filter(None, bounds)]
+        if bounds:
+            return max(bounds)
+
+    def setFormat(self, format):
+        """
+        Choose between json and the binary columnar format for snapshots,
+        existing sequences are converted the next time they are saved.
+        """
+        if format in self.extensions:
+            self.format = format
+
+    def convertFile(self, format):
+        """
+        Choose a format and convert the sequence open for editing to it
+        right away.
+        """
+        if format in self.extensions and format != self.format:
+            self.format = format
+            if self.directory and self.name:
+                self.saveFileNow()
+
+    def path(self, format=None):
+        return os.path.join(self.directory, self.name + self.extensions[format or self.format])
+
+    def existingPath(self):
+        for format in [self.format] + list(self.extensions):
+            if os.path.exists(self.path(format)):
+                return self.path(format)
+
+    def journal(self):
+        return Journal(os.path.join(self.directory, self.name + '.journal'))
 
     def load(self, name):
         self.saveFileNow()
@@ -441,10 +808,12 @@ class Sequence(Resource):
         self.reloadNames()
 
     def undo(self):
-        self.loadHistory(self.history_index - 1)
+        self.flushHistory()
+        self.loadHistory(self.history.index - 1)
 
     def redo(self):
-        self.loadHistory(self.history_index + 1)
+        self.flushHistory()
+        self.loadHistory(self.history.index + 1)
 
     def setDirectory(self, path):
         if os.path.exists(path) and os.path.isdir(path):
@@ -455,76 +824,192 @@ class Sequence(Resource):
             self.reloadNames()
 
     def saveRemoteNow(self):
-        self.sortData()
         if self.sequencing:
-            Resource.update(self, self.data())
+            if self.writing is not None:
+                # A partial body would replace the one waiting behind the
+                # post in flight, keep the tracks dirty and send them once
+                # it has landed
+                self.deferred = True
+                return
+            for name in self.dirtyRemote:
+                self.encoded.pop(name, None)
+            if self.partialUpload and self.synced:
+                names = [name for name in self.fields if name in self.dirtyRemote]
+            else:
+                names = list(self.fields)
+            self.dirtyRemote.clear()
+            if names:
+                Resource.update(self, self.encode(names))
+                self.synced = True
         else:
+            self.synced = False
             Resource.update(self, {})
 
+    def encode(self, names):
+        """
+        Request body holding the named tracks. Tracks that did not change
+        since they were last sent reuse their encoded json.
+        """
+        parts = []
+        for name in names:
+            if name not in self.encoded:
+                self.encoded[name] = codec.encode(name) + b':' + codec.encode(self.getKeyframes(name))
+            parts.append(self.encoded[name])
+        return b'{' + b','.join(parts) + b'}'
+
+    def resync(self):
+        self.synced = False
+        self.saveRemote()
+
+    def checkConnection(self):
+        # The game forgets the sequence when it restarts, send all of it
+        # again once it can be reached
+        online = not self.playback.failures
+        if online and not self.online and self.sequencing:
+            self.resync()
+        self.online = online
+
+    def finished(self, response, requestId):
+        if response.error() != QNetworkReply.NoError:
+            self.synced = False
+        Resource.finished(self, response, requestId)
+        if self.deferred and self.writing is None:
+            self.deferred = False
+            self.saveRemote()
+
     def saveRemote(self):
         self.saveRemoteTimer.start(0)
 
     def saveHistoryNow(self):
-        self.history = self.history[0:self.history_index + 1]
-        self.history_index = len(self.history)
-        self.history.append(copy.deepcopy(self.data()))
+        # Tracks of a binary snapshot that were never loaded stay out of
+        # the history until they are, see getKeyframes
+        names = [name for name in self.fields if name not in self.unloaded]
+        self.history.push({name: self.getKeyframes(name) for name in names}, self.dirtyHistory.difference(self.unloaded))
+        self.dirtyHistory.clear()
 
     def saveHistory(self):
         self.saveHistoryTimer.start(500)
 
+    def flushHistory(self):
+        if self.saveHistoryTimer.isActive():
+            self.saveHistoryTimer.stop()
+            self.saveHistoryNow()
+
     def loadHistory(self, index):
-        if len(self.history):
-            self.history_index = max(min(index, len(self.history) - 1), 0)
-            self.loadData(copy.deepcopy(self.history[self.history_index]))
+        tracks = self.history.load(index)
+        if tracks is not None:
+            self.loadData(tracks)
+            self.dirtyFile.update(tracks)
             self.saveRemote()
             self.saveFileNow()
 
     def resetHistory(self):
-        self.history = []
-        self.history_index = 0
-
-    def loadFile(self, name):
+        self.history.reset()
+        self.dirtyHistory.update(self.fields)
+
+    def loadFile(self, name, compact=True):
+        """
+        Without compact a leftover journal is only replayed in memory, so
+        loading never writes to the sequence directory.
+        """
+        self.closeSnapshot()
         self.name = name
-        if os.path.exists(self.path()):
-            with open(self.path(), 'r') as f:
-                self.resetHistory()
-                self.loadData(json.load(f))
-                self.saveRemote()
-                self.saveHistory()
+        path = self.existingPath()
+        entries = self.journal().replay()
+        if path or entries:
+            data = {}
+            lazy = []
+            if path and path.endswith(self.extensions['binary']):
+                self.snapshot = BinarySequence(path)
+                lazy = [track for track in self.snapshot.names() if track in self.fields]
+                data = {track: [] for track in lazy}
+            elif path:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            # Edits that never made it into the snapshot, most likely
+            # because we did not shut down cleanly
+            for entry in entries:
+                data.update(entry)
+            self.unloaded = set(lazy) - set(track for entry in entries for track in entry)
+            self.resetHistory()
+            self.loadData(data)
+            self.dirtyFile.clear()
+            if entries and compact:
+                self.compactFile()
+            self.saveRemote()
+            self.saveHistory()
 
     def saveFileNow(self, name=None):
+        """
+        Saving under a new name writes a full snapshot, otherwise only the
+        tracks edited since the last save are appended to the journal. The
+        journal is folded back into the snapshot once it outgrows it.
+        """
         self.name = name or self.name
         if self.name:
-            path = self.path()
-            exists = os.path.exists(path)
-            with open(path, 'w') as f:
-                json.dump(self.data(), f, sort_keys=True, indent=4)
-                if not exists:
-                    self.reloadNames()
+            if name is not None or not os.path.exists(self.path()):
+                self.compactFile()
+            elif self.dirtyFile:
+                journal = self.journal()
+                journal.append({track: self.getKeyframes(track) for track in sorted(self.dirtyFile)})
+                if journal.size() > max(os.path.getsize(self.path()), self.journalLimit):
+                    self.compactFile()
+            self.dirtyFile.clear()
+
+    def compactFile(self):
+        path = self.path()
+        exists = os.path.exists(path)
+        data = self.data()
+        self.closeSnapshot()
+        if self.format == 'binary':
+            writeBinary(path, data)
+        else:
+            atomicWrite(path, json.dumps(data, sort_keys=True, indent=4))
+        self.journal().clear()
+        self.dirtyFile.clear()
+        # Drop the copy in the other format when the sequence was converted
+        for format in self.extensions:
+            if format != self.format and os.path.exists(self.path(format)):
+                os.remove(self.path(format))
+        if not exists:
+            self.reloadNames()
+
+    def closeSnapshot(self):
+        self.unloaded.clear()
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
 
     def saveFile(self, name=None):
         self.name = name or self.name
         self.saveFileTimer.start(1000)
 
     def clearData(self):
+        self.closeSnapshot()
         for track in self.fields:
             getattr(self, track, []).clear()
+        self.dirtyHistory.update(self.fields)
+        self.dirtyFile.update(self.fields)
+        self.dirtyRemote.update(self.fields)
         self.dataLoaded.emit()
 
     def loadData(self, data):
         if isinstance(data, dict):
             for key, value in data.items():
                 if value is not None:
+                    if key in self.fields:
+                        value = Track(value)
+                        self.dirtyRemote.add(key)
                     super(Resource, self).__setattr__(key, value)
             self.dataLoaded.emit()
 
-    def sortData(self):
-        for track in self.fields:
-            if getattr(self, track):
-                getattr(self, track).sort(key = lambda item: item['time'])
-
     def reloadNames(self):
-        self.names = sorted([f.replace('.json', '') for f in os.listdir(self.directory) if f.endswith('.json')], key=str.lower)
+        names = set()
+        for f in os.listdir(self.directory):
+            name, extension = os.path.splitext(f)
+            if extension in self.extensions.values():
+                names.add(name)
+        self.names = sorted(names, key=str.lower)
         self.namesLoaded.emit()
 
     @property
@@ -536,11 +1021,35 @@ class Sequence(Resource):
 
     def setSequencing(self, value):
         self.sequencing = value
-        self.update()
+        self.saveRemote()
+
+    def setPartialUpload(self, value):
+        """
+        Send only the tracks that changed instead of the whole sequence.
+        The next upload is always a full one.
+        """
+        self.partialUpload = bool(value)
+        self.resync()
 
     def getKeyframes(self, name):
+        # Tracks of a binary snapshot are only decoded once someone asks
+        if name in self.unloaded:
+            self.unloaded.discard(name)
+            super(Resource, self).__setattr__(name, Track(self.snapshot.track(name)))
+            self.history.backfill(name, getattr(self, name))
+            if not self.unloaded:
+                self.closeSnapshot()
         return getattr(self, name)
 
+    def curve(self, name):
+        return Curve(self.getKeyframes(name))
+
+    def evaluate(self, name, time):
+        return self.curve(name).evaluate(time)
+
+    def sample(self, name, times):
+        return self.curve(name).sample(times)
+
     def createKeyframe(self, name):
         keyframe = {
             'time': self.playback.time,
@@ -551,12 +1060,35 @@ class Sequence(Resource):
         return keyframe
 
     def appendKeyframe(self, name, keyframe):
-        getattr(self, name).append(keyframe)
-        self.update()
+        self.getKeyframes(name).append(keyframe)
+        self.update(name)
 
     def removeKeyframe(self, name, item):
-        getattr(self, name).remove(item)
-        self.update()
+        self.getKeyframes(name).remove(item)
+        self.update(name)
+
+    def clearKeyframes(self, name):
+        self.getKeyframes(name).clear()
+        self.update(name)
+
+    def moveKeyframe(self, name, item, time):
+        self.getKeyframes(name).move(item, time)
+        self.update(name)
+
+    def replaceKeyframes(self, name, keyframes, start=None, end=None):
+        """
+        Swap the keyframes between start and end, or the whole track, for
+        new ones.
+        """
+        track = self.getKeyframes(name)
+        if start is None:
+            track.clear()
+        else:
+            for keyframe in track.between(start, end):
+                track.remove(keyframe)
+        track.extend(keyframes)
+        self.update(name)
+        self.dataLoaded.emit()
 
     def getLabel(self, name):
         if name == 'cameraPosition':
@@ -670,3 +1202,123 @@ class Sequence(Resource):
             return self.render.depthOfFieldMid
         if name == 'depthOfFieldFar':
             return self.render.depthOfFieldFar
+
+
+class Api(QObject):
+    """
+    Every resource of one replay api.
+    """
+    connected = Signal()
+
+    def __init__(self, endpoint=None):
+        QObject.__init__(self)
+        self.wasConnected = False
+        self.endpoint = endpoint or Endpoint.default()
+        self.game = Game(self.endpoint)
+        self.render = Render(self.endpoint)
+        self.particles = Particles(self.endpoint)
+        self.playback = Playback(self.endpoint)
+        self.recording = Recording(self.endpoint)
+        self.sequence = Sequence(self.render, self.playback)
+        self.game.updated.connect(self.updated)
+        self.render.updated.connect(self.updated)
+        self.particles.updated.connect(self.updated)
+        self.playback.updated.connect(self.updated)
+        self.recording.updated.connect(self.updated)
+
+    def updated(self):
+        if not self.wasConnected and self.game.connected:
+            self.connected.emit()
+        self.wasConnected = self.game.connected
+
+    def update(self):
+        self.game.update()
+        self.render.update()
+        self.particles.update()
+        self.playback.update()
+        self.recording.update()
+
+    def start(self):
+        self.game.startPolling()
+        self.render.startPolling()
+        self.particles.startPolling()
+        self.playback.startPolling()
+        self.recording.startPolling()
+
+    def onKeybinding(self, name):
+        if name == 'camera_up':
+            self.render.moveCamera(y=7)
+        elif name == 'camera_down':
+            self.render.moveCamera(y=-7)
+        elif name == 'camera_move_speed_up':
+            self.render.cameraMoveSpeed = self.render.cameraMoveSpeed * 1.2
+        elif name == 'camera_move_speed_down':
+            self.render.cameraMoveSpeed = self.render.cameraMoveSpeed * 0.8
+        elif name == 'camera_look_speed_up':
+            self.render.cameraLookSpeed = self.render.cameraLookSpeed * 1.1
+        elif name == 'camera_look_speed_down':
+            self.render.cameraLookSpeed = self.render.cameraLookSpeed * 0.9
+        elif name == 'camera_yaw_left':
+            self.render.rotateCamera(x=-1)
+        elif name == 'camera_yaw_right':
+            self.render.rotateCamera(x=1)
+        elif name == 'camera_pitch_up':
+            self.render.rotateCamera(y=-1)
+        elif name == 'camera_pitch_down':
+            self.render.rotateCamera(y=1)
+        elif name == 'camera_roll_left':
+            self.render.rotateCamera(z=1)
+        elif name == 'camera_roll_right':
+            self.render.rotateCamera(z=-1)
+        elif name == 'camera_move_back_x':
+            self.render.toggleCameraMoveBackX()
+        elif name == 'camera_move_back_y':
+            self.render.toggleCameraMoveBackY()
+        elif name == 'camera_move_back_z':
+            self.render.toggleCameraMoveBackZ()
+        elif name == 'camera_lock_x':
+            self.render.cameraLockX = not self.render.cameraLockX
+        elif name == 'camera_lock_y':
+            self.render.cameraLockY = not self.render.cameraLockY
+        elif name == 'camera_lock_z':
+            self.render.cameraLockZ = not self.render.cameraLockZ
+        elif name == 'camera_attach':
+            self.render.cameraAttached = not self.render.cameraAttached
+        elif name == 'camera_fov_up':
+            self.render.fieldOfView = self.render.fieldOfView * 1.05
+        elif name == 'camera_fov_down':
+            self.render.fieldOfView = self.render.fieldOfView * 0.95
+        elif name == 'render_dof_near_up':
+            self.render.depthOfFieldNear = self.render.depthOfFieldNear * 1.05
+        elif name == 'render_dof_near_down':
+            self.render.depthOfFieldNear = self.render.depthOfFieldNear * 0.95
+        elif name == 'render_dof_mid_up':
+            self.render.depthOfFieldMid = self.render.depthOfFieldMid * 1.05
+        elif name == 'render_dof_mid_down':
+            self.render.depthOfFieldMid = self.render.depthOfFieldMid * 0.95
+        elif name == 'render_dof_far_up':
+            self.render.depthOfFieldFar = self.render.depthOfFieldFar * 1.05
+        elif name == 'render_dof_far_down':
+            self.render.depthOfFieldFar = self.render.depthOfFieldFar * 0.95
+        elif name == 'play_pause':
+            self.playback.paused = not self.playback.paused
+        elif name == 'time_minus_120':
+            self.playback.adjustTime(-120)
+        elif name == 'time_minus_60':
+            self.playback.adjustTime(-60)
+        elif name == 'time_minus_30':
+            self.playback.adjustTime(-30)
+        elif name == 'time_minus_10':
+            self.playback.adjustTime(-10)
+        elif name == 'time_minus_5':
+            self.playback.adjustTime(-5)
+        elif name == 'time_plus_5':
+            self.playback.adjustTime(5)
+        elif name == 'time_plus_10':
+            self.playback.adjustTime(10)
+        elif name == 'time_plus_30':
+            self.playback.adjustTime(30)
+        elif name == 'time_plus_60':
+            self.playback.adjustTime(60)
+        elif name == 'time_plus_120':
+            self.playback.adjustTime(120)
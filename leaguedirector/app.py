@@ -1,6 +1,8 @@
 import os
 import sys
 import json
+import re
+import bisect
 import functools
 import logging
 import logging.handlers
@@ -12,9 +14,13 @@ from PySide6.QtNetwork import *
 from leaguedirector.widgets import *
 from leaguedirector.sequencer import *
 from leaguedirector.enable import *
-from leaguedirector.api import Game, Playback, Render, Particles, Recording, Sequence
+from leaguedirector.api import Api, Game, Playback, Render, Particles, Recording, Sequence
 from leaguedirector.bindings import Bindings
 from leaguedirector.settings import Settings
+from leaguedirector.rules import ParticleRule
+from leaguedirector.segments import SegmentedRecording
+from leaguedirector.telemetry import RenderTelemetry, formatDuration
+from leaguedirector.baking import CameraRecorder, simplifyCamera
 
 
 class SkyboxCombo(QComboBox):
@@ -108,7 +114,7 @@ class VisibleWindow(QScrollArea):
     def __init__(self, api):
         QScrollArea.__init__(self)
         self.api = api
-        self.api.render.updated.connect(self.update)
+        self.api.render.fieldsChanged.connect(self.updateFields)
         self.api.connected.connect(self.connect)
         self.inputs = {}
         self.bindings = {}
@@ -131,8 +137,12 @@ class VisibleWindow(QScrollArea):
             self.api.render.set(name, field.value())
 
     def update(self):
-        for name, field in self.inputs.items():
-            field.setValue(self.api.render.get(name))
+        self.updateFields(self.inputs)
+
+    def updateFields(self, names):
+        for name in names:
+            if name in self.inputs:
+                self.inputs[name].setValue(self.api.render.get(name))
 
     def restoreSettings(self, data):
         for name, value in data.items():
@@ -149,10 +159,46 @@ class VisibleWindow(QScrollArea):
 
 
 class RenderWindow(QScrollArea):
+    fields = [
+        'cameraLockX',
+        'cameraLockY',
+        'cameraLockZ',
+        'cameraPosition',
+        'cameraRotation',
+        'cameraAttached',
+        'cameraMoveSpeed',
+        'cameraLookSpeed',
+        'fieldOfView',
+        'nearClip',
+        'farClip',
+        'simulateAllParticlesWhileOffScreen',
+        'skyboxRotation',
+        'skyboxRadius',
+        'skyboxOffset',
+        'sunDirection',
+        'depthFogEnabled',
+        'depthFogStart',
+        'depthFogEnd',
+        'depthFogIntensity',
+        'depthFogColor',
+        'heightFogEnabled',
+        'heightFogStart',
+        'heightFogEnd',
+        'heightFogIntensity',
+        'heightFogColor',
+        'depthOfFieldEnabled',
+        'depthOfFieldDebug',
+        'depthOfFieldCircle',
+        'depthOfFieldWidth',
+        'depthOfFieldNear',
+        'depthOfFieldMid',
+        'depthOfFieldFar',
+    ]
+
     def __init__(self, api):
         QScrollArea.__init__(self)
         self.api = api
-        self.api.render.updated.connect(self.update)
+        self.api.render.fieldsChanged.connect(self.updateFields)
         self.cameraMode = QLabel('')
         self.cameraLockX = BooleanInput('X')
         self.cameraLockY = BooleanInput('Y')
@@ -215,6 +261,9 @@ class RenderWindow(QScrollArea):
         self.cameraMoveBackX.valueChanged.connect(self.api.render.toggleCameraMoveBackX)
         self.cameraMoveBackY.valueChanged.connect(self.api.render.toggleCameraMoveBackY)
         self.cameraMoveBackZ.valueChanged.connect(self.api.render.toggleCameraMoveBackZ)
+        self.cameraMoveBackX.valueChanged.connect(self.updateCameraMoveBack)
+        self.cameraMoveBackY.valueChanged.connect(self.updateCameraMoveBack)
+        self.cameraMoveBackZ.valueChanged.connect(self.updateCameraMoveBack)
         self.cameraPosition.valueChanged.connect(functools.partial(self.api.render.set, 'cameraPosition'))
         self.cameraRotation.valueChanged.connect(functools.partial(self.api.render.set, 'cameraRotation'))
         self.cameraAttached.valueChanged.connect(functools.partial(self.api.render.set, 'cameraAttached'))
@@ -294,51 +343,92 @@ class RenderWindow(QScrollArea):
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setWidget(widget)
         self.setWindowTitle('渲染设置')
+        self.inputs = {name: getattr(self, name) for name in self.fields}
+        self.inputs['navGridOffset'] = self.navGrid
+        self.update()
 
     def update(self):
-        self.cameraLockX.update(self.api.render.cameraLockX)
-        self.cameraLockY.update(self.api.render.cameraLockY)
-        self.cameraLockZ.update(self.api.render.cameraLockZ)
+        self.updateFields(set(self.api.render.fields))
+
+    def updateFields(self, names):
+        for name in names:
+            if name in self.inputs:
+                self.inputs[name].update(self.api.render.get(name))
+        if 'cameraMode' in names:
+            self.cameraMode.setText(self.api.render.cameraMode)
+        if 'skyboxRadius' in names:
+            self.skyboxOffset.setRange(-self.api.render.skyboxRadius, self.api.render.skyboxRadius)
+            self.skyboxOffset.setSingleStep(self.api.render.skyboxRadius / 1000)
+        if 'cameraPosition' in names:
+            self.updateCameraMoveBack()
+
+    def updateCameraMoveBack(self, *args):
         self.cameraMoveBackX.update(self.api.render.cameraMoveBackX is not None)
         self.cameraMoveBackY.update(self.api.render.cameraMoveBackY is not None)
         self.cameraMoveBackZ.update(self.api.render.cameraMoveBackZ is not None)
         self.cameraMoveBackX.setCheckboxText('{0:.2f}'.format(self.api.render.cameraMoveBackX) if self.api.render.cameraMoveBackX else 'X')
         self.cameraMoveBackY.setCheckboxText('{0:.2f}'.format(self.api.render.cameraMoveBackY) if self.api.render.cameraMoveBackY else 'Y')
         self.cameraMoveBackZ.setCheckboxText('{0:.2f}'.format(self.api.render.cameraMoveBackZ) if self.api.render.cameraMoveBackZ else 'Z')
-        self.cameraMode.setText(self.api.render.cameraMode)
-        self.cameraPosition.update(self.api.render.cameraPosition)
-        self.cameraRotation.update(self.api.render.cameraRotation)
-        self.cameraAttached.update(self.api.render.cameraAttached)
-        self.cameraMoveSpeed.update(self.api.render.cameraMoveSpeed)
-        self.cameraLookSpeed.update(self.api.render.cameraLookSpeed)
-        self.fieldOfView.update(self.api.render.fieldOfView)
-        self.nearClip.update(self.api.render.nearClip)
-        self.farClip.update(self.api.render.farClip)
-        self.navGrid.update(self.api.render.navGridOffset)
-        self.simulateAllParticlesWhileOffScreen.update(self.api.render.simulateAllParticlesWhileOffScreen)
-        self.skyboxRotation.update(self.api.render.skyboxRotation)
-        self.skyboxRadius.update(self.api.render.skyboxRadius)
-        self.skyboxOffset.update(self.api.render.skyboxOffset)
-        self.skyboxOffset.setRange(-self.api.render.skyboxRadius, self.api.render.skyboxRadius)
-        self.skyboxOffset.setSingleStep(self.api.render.skyboxRadius / 1000)
-        self.sunDirection.update(self.api.render.sunDirection)
-        self.depthFogEnabled.update(self.api.render.depthFogEnabled)
-        self.depthFogStart.update(self.api.render.depthFogStart)
-        self.depthFogEnd.update(self.api.render.depthFogEnd)
-        self.depthFogIntensity.update(self.api.render.depthFogIntensity)
-        self.depthFogColor.update(self.api.render.depthFogColor)
-        self.heightFogEnabled.update(self.api.render.heightFogEnabled)
-        self.heightFogStart.update(self.api.render.heightFogStart)
-        self.heightFogEnd.update(self.api.render.heightFogEnd)
-        self.heightFogIntensity.update(self.api.render.heightFogIntensity)
-        self.heightFogColor.update(self.api.render.heightFogColor)
-        self.depthOfFieldEnabled.update(self.api.render.depthOfFieldEnabled)
-        self.depthOfFieldDebug.update(self.api.render.depthOfFieldDebug)
-        self.depthOfFieldCircle.update(self.api.render.depthOfFieldCircle)
-        self.depthOfFieldWidth.update(self.api.render.depthOfFieldWidth)
-        self.depthOfFieldNear.update(self.api.render.depthOfFieldNear)
-        self.depthOfFieldMid.update(self.api.render.depthOfFieldMid)
-        self.depthOfFieldFar.update(self.api.render.depthOfFieldFar)
+
+
+class ParticlesModel(QAbstractListModel):
+    """
+    Sorted particle names and their enabled state. Changes reported by
+    the particles resource only insert, remove or refresh the rows of the
+    particles involved.
+    """
+
+    def __init__(self, particles):
+        QAbstractListModel.__init__(self)
+        self.particles = particles
+        self.particles.fieldsChanged.connect(self.particlesChanged)
+        self.names = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def flags(self, index):
+        return Qt.ItemIsUserCheckable | Qt.ItemIsEnabled
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid():
+            name = self.names[index.row()]
+            if role == Qt.DisplayRole:
+                return name
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if self.particles.getParticle(name) else Qt.Unchecked
+            if role == Qt.BackgroundRole:
+                return QApplication.palette().toolTipBase()
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if index.isValid() and role == Qt.CheckStateRole:
+            self.particles.setParticle(self.names[index.row()], Qt.CheckState(value) == Qt.Checked)
+            return True
+        return False
+
+    def particlesChanged(self, names):
+        # Rebuilding is cheaper than row by row inserts for a new replay
+        if len(names) > max(len(self.names) // 2, 100):
+            self.beginResetModel()
+            self.names = sorted(name for name, enabled in self.particles.items())
+            self.endResetModel()
+            return
+        for name in sorted(names):
+            row = bisect.bisect_left(self.names, name)
+            present = row < len(self.names) and self.names[row] == name
+            if self.particles.hasParticle(name):
+                if present:
+                    index = self.index(row)
+                    self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+                else:
+                    self.beginInsertRows(QModelIndex(), row, row)
+                    self.names.insert(row, name)
+                    self.endInsertRows()
+            elif present:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.names[row]
+                self.endRemoveRows()
 
 
 class ParticlesWindow(VBoxWidget):
@@ -346,45 +436,119 @@ class ParticlesWindow(VBoxWidget):
         VBoxWidget.__init__(self)
         self.api = api
         self.api.connected.connect(self.connect)
-        self.api.particles.updated.connect(self.update)
-        self.items = {}
+        self.model = ParticlesModel(self.api.particles)
+        self.proxy = QSortFilterProxyModel()
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
         self.search = QLineEdit()
         self.search.setPlaceholderText('搜索粒子...')
-        self.search.textEdited.connect(self.textEdited)
-        self.list = QListWidget()
-        self.list.setSortingEnabled(True)
-        self.list.itemChanged.connect(self.itemChanged)
+        self.search.textChanged.connect(self.proxy.setFilterFixedString)
+        self.list = QListView()
+        self.list.setModel(self.proxy)
+        self.list.setUniformItemSizes(True)
+        self.enableAll = QPushButton('全部启用')
+        self.enableAll.setToolTip('只作用于搜索结果')
+        self.enableAll.clicked.connect(lambda: self.setParticlesEnabled(True))
+        self.disableAll = QPushButton('全部禁用')
+        self.disableAll.setToolTip('只作用于搜索结果')
+        self.disableAll.clicked.connect(lambda: self.setParticlesEnabled(False))
         self.addWidget(self.search)
         self.addWidget(self.list)
+        self.addWidget(HBoxWidget(self.enableAll, self.disableAll))
+        self.layoutRules()
         self.setWindowTitle('粒子效果')
 
-    def textEdited(self, text):
-        search = text.lower()
-        for particle, item in self.items.items():
-            if len(search) == 0 or search in particle.lower():
-                item.setHidden(False)
-            else:
-                item.setHidden(True)
+    def layoutRules(self):
+        self.presets = {}
+        self.presetCombo = QComboBox()
+        self.presetCombo.activated.connect(self.loadPreset)
+        self.include = QLineEdit()
+        self.include.setPlaceholderText('包含，空格分隔 (例如 Ahri_* re:^Yasuo_.*_R)')
+        self.exclude = QLineEdit()
+        self.exclude.setPlaceholderText('排除，空格分隔')
+        self.ruleEnabled = QComboBox()
+        self.ruleEnabled.addItem('禁用匹配的粒子', False)
+        self.ruleEnabled.addItem('启用匹配的粒子', True)
+        self.ruleStatus = QLabel('')
+        applyRule = QPushButton('应用规则')
+        applyRule.clicked.connect(self.applyRule)
+        clearRule = QPushButton('清除规则')
+        clearRule.clicked.connect(self.clearRule)
+        savePreset = QPushButton('保存预设')
+        savePreset.clicked.connect(self.savePreset)
+        deletePreset = QPushButton('删除预设')
+        deletePreset.clicked.connect(self.deletePreset)
+        self.addWidget(Separator())
+        self.addWidget(HBoxWidget(self.presetCombo, savePreset, deletePreset))
+        self.addWidget(self.include)
+        self.addWidget(self.exclude)
+        self.addWidget(HBoxWidget(self.ruleEnabled, applyRule, clearRule))
+        self.addWidget(self.ruleStatus)
+
+    def setParticlesEnabled(self, enabled):
+        names = [self.proxy.index(row, 0).data() for row in range(self.proxy.rowCount())]
+        self.api.particles.setParticles({name: enabled for name in names})
+
+    def createRule(self):
+        try:
+            return ParticleRule(self.include.text().split(), self.exclude.text().split(), self.ruleEnabled.currentData())
+        except re.error as error:
+            self.ruleStatus.setText('无效的正则表达式: {}'.format(error))
+
+    def showRule(self, rule):
+        self.include.setText(' '.join(rule.include))
+        self.exclude.setText(' '.join(rule.exclude))
+        self.ruleEnabled.setCurrentIndex(self.ruleEnabled.findData(rule.enabled))
+
+    def applyRule(self):
+        rule = self.createRule()
+        if rule is not None:
+            self.api.particles.setRules([rule])
+            self.ruleStatus.setText('规则已应用')
+
+    def clearRule(self):
+        self.api.particles.setRules([])
+        self.ruleStatus.setText('')
+
+    def savePreset(self):
+        rule = self.createRule()
+        if rule is not None:
+            name, ok = QInputDialog.getText(self, '保存预设', '输入预设名称', text=self.presetCombo.currentText())
+            if ok and name:
+                self.presets[name] = [rule.data()]
+                self.updatePresets(name)
+
+    def deletePreset(self):
+        self.presets.pop(self.presetCombo.currentText(), None)
+        self.updatePresets()
+
+    def loadPreset(self, index):
+        rules = [ParticleRule.fromData(data) for data in self.presets.get(self.presetCombo.itemText(index), [])]
+        if rules:
+            self.showRule(rules[-1])
+            self.api.particles.setRules(rules)
+            self.ruleStatus.setText('规则已应用')
+
+    def updatePresets(self, current=None):
+        self.presetCombo.clear()
+        for name in sorted(self.presets, key=str.lower):
+            self.presetCombo.addItem(name)
+        if current is not None:
+            self.presetCombo.setCurrentText(current)
 
-    def itemChanged(self, item):
-        particle = item.text()
-        enabled = item.checkState() == Qt.Checked
-        if enabled != self.api.particles.getParticle(particle):
-            self.api.particles.setParticle(particle, enabled)
+    def saveSettings(self):
+        return {
+            'presets': self.presets,
+            'rules': [rule.data() for rule in self.api.particles.rules],
+        }
 
-    def update(self):
-        for particle, enabled in self.api.particles.items():
-            if particle not in self.items:
-                item = QListWidgetItem(particle)
-                item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-                item.setBackground(QApplication.palette().toolTipBase())
-                self.list.addItem(item)
-                self.items[particle] = item
-            self.items[particle].setCheckState(Qt.Checked if enabled else Qt.Unchecked)
-        for particle in list(self.items):
-            if not self.api.particles.hasParticle(particle):
-                item = self.items.pop(particle)
-                self.list.takeItem(self.list.row(item))
+    def restoreSettings(self, data):
+        self.presets = data.get('presets', {})
+        self.updatePresets()
+        rules = [ParticleRule.fromData(rule) for rule in data.get('rules', [])]
+        if rules:
+            self.showRule(rules[-1])
+            self.api.particles.setRules(rules)
 
     def connect(self):
         self.search.clear()
@@ -396,6 +560,8 @@ class RecordingWindow(VBoxWidget):
         self.api = api
         self.api.recording.updated.connect(self.update)
         self.recordings = set()
+        self.segments = None
+        self.telemetry = RenderTelemetry()
 
         self.codec = QComboBox()
         self.codec.addItem('webm')
@@ -405,6 +571,8 @@ class RecordingWindow(VBoxWidget):
         self.fps = FloatInput(0, 400)
         self.fps.setValue(60)
         self.lossless = BooleanInput()
+        self.segment = FloatInput(0, 3600)
+        self.segment.setToolTip('按此时长分段录制，中断后可从上次完成的片段继续，0 表示不分段')
 
         self.outputPath = userpath('recordings')
         self.outputLabel = QLabel()
@@ -433,6 +601,7 @@ class RecordingWindow(VBoxWidget):
         self.formLayout.addRow('结束时间', self.endTime)  # End Time
         self.formLayout.addRow('帧率(FPS)', self.fps)  # Frames Per Second
         self.formLayout.addRow('无损编码', self.lossless)  # Lossless Encoding
+        self.formLayout.addRow('分段时长', self.segment)  # Segment Length
         self.formLayout.addRow('输出目录', HBoxWidget(self.outputButton, self.outputLabel))  # Output Directory
         self.formLayout.addRow(HBoxWidget(self.button, self.button2))
         self.formLayout.addRow(self.list)
@@ -440,11 +609,13 @@ class RecordingWindow(VBoxWidget):
 
         self.render = QWidget(self)
         self.progress = QProgressBar()
+        self.estimate = QLabel()
         self.cancel = QPushButton('取消录制')
         self.cancel.clicked.connect(self.stopRecording)
         self.renderLayout = QFormLayout()
         self.renderLayout.addRow(QLabel('视频渲染中...'))
         self.renderLayout.addRow(self.progress)
+        self.renderLayout.addRow(self.estimate)
         self.renderLayout.addRow(self.cancel)
         self.render.setLayout(self.renderLayout)
 
@@ -455,15 +626,51 @@ class RecordingWindow(VBoxWidget):
     def update(self):
         self.startTime.setRange(0, self.api.playback.length)
         self.endTime.setRange(0, self.api.playback.length)
-        self.render.setVisible(self.api.recording.recording)
-        self.form.setVisible(not self.api.recording.recording)
-        if self.api.recording.recording:
+        segmented = self.segments is not None and self.segments.active
+        self.render.setVisible(self.api.recording.recording or segmented)
+        self.form.setVisible(not self.api.recording.recording and not segmented)
+        if segmented:
+            self.progress.setMinimum(self.segments.startTime * 1000)
+            self.progress.setMaximum(self.segments.endTime * 1000)
+            self.progress.setValue((self.segments.startTime + self.segments.currentTime) * 1000)
+            self.updateTelemetry(True, self.segments.startTime + self.segments.currentTime)
+        elif self.api.recording.recording:
             self.progress.setMinimum(self.api.recording.startTime * 1000)
             self.progress.setMaximum(self.api.recording.endTime * 1000)
             self.progress.setValue(self.api.recording.currentTime * 1000)
+            self.updateTelemetry(True, self.api.recording.currentTime)
             if self.api.recording.path not in self.recordings:
                 self.list.addItem(self.api.recording.path)
                 self.recordings.add(self.api.recording.path)
+        else:
+            self.updateTelemetry(False)
+
+    def updateTelemetry(self, recording, currentTime=None):
+        telemetry = self.telemetry
+        if not telemetry.active:
+            return
+        if recording:
+            telemetry.sample(currentTime)
+            remaining = telemetry.remaining()
+            if remaining is None:
+                self.estimate.setText('正在估算剩余时间...')
+            else:
+                self.estimate.setText('剩余 {} · {:.1f} 帧/秒 · {:.2f}x 实时'.format(
+                    formatDuration(remaining), telemetry.framesPerSecond(), telemetry.realtime(),
+                ))
+        elif telemetry.samples:
+            # Only a render that was seen running can have finished
+            finished = telemetry.currentTime >= telemetry.settings['endTime'] - SegmentedRecording.tolerance
+            telemetry.finish('done' if finished else 'cancelled', width=self.api.recording.width, height=self.api.recording.height)
+            self.estimate.setText('')
+
+    def startTelemetry(self, resumed=0):
+        self.telemetry.start(
+            self.codec.currentText(), self.fps.value(), self.startTime.value(), self.endTime.value(),
+            self.lossless.value(), self.api.recording.width, self.api.recording.height, resumed,
+            segment=self.segment.value(),
+        )
+        self.estimate.setText('正在估算剩余时间...')
 
     def selectOutputDirectory(self):
         self.setOutputDirectory(QFileDialog.getExistingDirectory(self, '选择输出目录', self.outputPath))
@@ -472,9 +679,15 @@ class RecordingWindow(VBoxWidget):
         QDesktopServices.openUrl(QUrl('file:///{}'.format(item.text())))
 
     def stopRecording(self):
+        if self.segments is not None and self.segments.active:
+            self.segments.stop()
         self.api.recording.update({'recording' : False})
 
     def startRecording(self):
+        if self.segment.value() > 0:
+            self.startSegmentedRecording()
+            return
+        self.startTelemetry()
         self.api.playback.play()
         self.api.recording.update({
             'recording' : True,
@@ -487,6 +700,33 @@ class RecordingWindow(VBoxWidget):
             'path' : self.outputPath,
         })
 
+    def startSegmentedRecording(self):
+        """
+        Record into a directory named after the sequence and range, so
+        recording the same range again picks up where it stopped.
+        """
+        startTime = self.startTime.value()
+        endTime = self.endTime.value()
+        name = '{}_{}-{}'.format(self.api.sequence.name or 'recording', int(startTime * 1000), int(endTime * 1000))
+        output = os.path.join(self.outputPath, name)
+        self.segments = SegmentedRecording(
+            self.api, output, self.codec.currentText(), self.fps.value(),
+            startTime, endTime, self.segment.value(), self.lossless.value(),
+        )
+        self.segments.progressed.connect(self.update)
+        self.segments.finished.connect(self.update)
+        self.segments.failed.connect(self.segmentsFailed)
+        self.segments.start()
+        self.startTelemetry(self.segments.resumedTime())
+        if output not in self.recordings:
+            self.list.addItem(output)
+            self.recordings.add(output)
+        self.update()
+
+    def segmentsFailed(self, error):
+        logging.error('Segmented recording failed: %s', error)
+        self.update()
+
     def setOutputDirectory(self, path):
         if os.path.exists(path):
             self.outputPath = path
@@ -499,10 +739,11 @@ class RecordingWindow(VBoxWidget):
         self.startRecording()
 
     def saveSettings(self):
-        return {'output': self.outputPath}
+        return {'output': self.outputPath, 'segment': self.segment.value()}
 
     def restoreSettings(self, data):
         self.setOutputDirectory(data.get('output', self.outputPath))
+        self.segment.setValue(data.get('segment', 0))
 
 
 class TimelineWindow(QWidget):
@@ -512,6 +753,7 @@ class TimelineWindow(QWidget):
         self.api.playback.updated.connect(self.update)
         self.api.sequence.updated.connect(self.update)
         self.timer = schedule(10, self.animate)
+        self.cameraRecorder = CameraRecorder(self.api)
         self.sequenceHeaders = SequenceHeaderView(self.api)
         self.sequenceTracks = SequenceTrackView(self.api, self.sequenceHeaders)
         layout = QVBoxLayout()
@@ -523,10 +765,24 @@ class TimelineWindow(QWidget):
         self.setLayout(layout)
 
     def saveSettings(self):
-        return {'directory': self.api.sequence.directory}
+        return {
+            'directory': self.api.sequence.directory,
+            'format': self.api.sequence.format,
+            'partialUpload': self.partialUpload.value(),
+            'positionTolerance': self.positionTolerance.value(),
+            'angleTolerance': self.angleTolerance.value(),
+        }
 
     def restoreSettings(self, data):
+        self.api.sequence.setFormat(data.get('format', 'json'))
+        self.sequenceFormat.setCurrentIndex(max(self.sequenceFormat.findData(self.api.sequence.format), 0))
         self.api.sequence.setDirectory(data.get('directory', userpath('sequences')))
+        self.partialUpload.setValue(data.get('partialUpload', False))
+        self.positionTolerance.setValue(data.get('positionTolerance', 5))
+        self.angleTolerance.setValue(data.get('angleTolerance', 0.5))
+
+    def selectFormat(self):
+        self.api.sequence.convertFile(self.sequenceFormat.currentData())
 
     def selectDirectory(self):
         self.api.sequence.setDirectory(QFileDialog.getExistingDirectory(self, '选择目录', self.api.sequence.directory))
@@ -538,7 +794,12 @@ class TimelineWindow(QWidget):
         self.sequenceButton.setFixedWidth(30)
         self.sequenceButton.setIcon(self.style().standardIcon(QStyle.SP_FileDialogStart))
         self.sequenceButton.clicked.connect(self.selectDirectory)
-        layout.addWidget(HBoxWidget(self.sequenceCombo, self.sequenceButton))
+        self.sequenceFormat = QComboBox()
+        self.sequenceFormat.setToolTip('保存格式，切换后当前序列会立即转换')
+        self.sequenceFormat.addItem('JSON', 'json')
+        self.sequenceFormat.addItem('二进制 (.ldseq)', 'binary')
+        self.sequenceFormat.currentIndexChanged.connect(self.selectFormat)
+        layout.addWidget(HBoxWidget(self.sequenceCombo, self.sequenceButton, self.sequenceFormat))
 
         widget = HBoxWidget()
         self.applySequence = BooleanInput('应用序列？')
@@ -556,7 +817,12 @@ class TimelineWindow(QWidget):
         newSequence.setMaximumWidth(150)
         newSequence.clicked.connect(self.newSequence)
         widget.addWidget(newSequence)
+        self.partialUpload = BooleanInput('仅上传改动')
+        self.partialUpload.setToolTip('只发送改动过的轨道。游戏每次都会替换整个序列，仅在客户端会合并轨道时开启')
+        self.partialUpload.valueChanged.connect(self.api.sequence.setPartialUpload)
+        widget.addWidget(self.partialUpload)
         layout.addWidget(widget)
+        self.layoutBaking(layout)
 
         widget = HBoxWidget()
         widget.addWidget(self.sequenceHeaders)
@@ -566,6 +832,46 @@ class TimelineWindow(QWidget):
         sequenceSelection = SequenceSelectedView(self.api, self.sequenceTracks)
         layout.addWidget(sequenceSelection)
 
+    def layoutBaking(self, layout):
+        widget = HBoxWidget()
+        self.captureCamera = QPushButton('录制镜头')
+        self.captureCamera.setToolTip('播放时连续采集镜头，停止后烘焙为最少的关键帧')
+        self.captureCamera.setCheckable(True)
+        self.captureCamera.toggled.connect(self.toggleCameraCapture)
+        widget.addWidget(self.captureCamera)
+        simplifyButton = QPushButton('精简镜头关键帧')
+        simplifyButton.setToolTip('在误差范围内用最少的关键帧重现当前镜头轨迹')
+        simplifyButton.clicked.connect(self.simplifyCamera)
+        widget.addWidget(simplifyButton)
+        self.positionTolerance = FloatInput(0, 1000)
+        self.positionTolerance.setValue(5)
+        self.positionTolerance.setToolTip('位置误差')
+        widget.addWidget(QLabel('位置误差'))
+        widget.addWidget(self.positionTolerance)
+        self.angleTolerance = FloatInput(0, 45)
+        self.angleTolerance.setValue(0.5)
+        self.angleTolerance.setToolTip('角度误差（度）')
+        widget.addWidget(QLabel('角度误差'))
+        widget.addWidget(self.angleTolerance)
+        layout.addWidget(widget)
+
+    def toggleCameraCapture(self, checked):
+        if checked:
+            # The camera has to be free to be captured
+            if self.applySequence.value():
+                self.applySequence.toggle()
+            self.cameraRecorder.start()
+            self.captureCamera.setText('停止录制镜头')
+        else:
+            self.cameraRecorder.stop()
+            samples, keyframes = self.cameraRecorder.bake(self.positionTolerance.value(), self.angleTolerance.value())
+            logging.info('Baked %d camera samples into %d keyframes', samples, keyframes)
+            self.captureCamera.setText('录制镜头')
+
+    def simplifyCamera(self):
+        before, after = simplifyCamera(self.api.sequence, self.positionTolerance.value(), self.angleTolerance.value())
+        logging.info('Simplified camera from %d to %d keyframes', before, after)
+
     def layoutSpeed(self, layout):
         widget = HBoxWidget()
         self.play = QPushButton("")
@@ -730,115 +1036,6 @@ class TimelineWindow(QWidget):
             self.play.setText('暂停')
 
 
-class Api(QObject):
-    connected = Signal()
-
-    def __init__(self):
-        QObject.__init__(self)
-        self.wasConnected = False
-        self.game = Game()
-        self.render = Render()
-        self.particles = Particles()
-        self.playback = Playback()
-        self.recording = Recording()
-        self.sequence = Sequence(self.render, self.playback)
-        self.game.updated.connect(self.updated)
-        self.render.updated.connect(self.updated)
-        self.particles.updated.connect(self.updated)
-        self.playback.updated.connect(self.updated)
-        self.recording.updated.connect(self.updated)
-
-    def updated(self):
-        if not self.wasConnected and self.game.connected:
-            self.connected.emit()
-        self.wasConnected = self.game.connected
-
-    def update(self):
-        self.game.update()
-        self.render.update()
-        self.particles.update()
-        self.playback.update()
-        self.recording.update()
-
-    def onKeybinding(self, name):
-        if name == 'camera_up':
-            self.render.moveCamera(y=7)
-        elif name == 'camera_down':
-            self.render.moveCamera(y=-7)
-        elif name == 'camera_move_speed_up':
-            self.render.cameraMoveSpeed = self.render.cameraMoveSpeed * 1.2
-        elif name == 'camera_move_speed_down':
-            self.render.cameraMoveSpeed = self.render.cameraMoveSpeed * 0.8
-        elif name == 'camera_look_speed_up':
-            self.render.cameraLookSpeed = self.render.cameraLookSpeed * 1.1
-        elif name == 'camera_look_speed_down':
-            self.render.cameraLookSpeed = self.render.cameraLookSpeed * 0.9
-        elif name == 'camera_yaw_left':
-            self.render.rotateCamera(x=-1)
-        elif name == 'camera_yaw_right':
-            self.render.rotateCamera(x=1)
-        elif name == 'camera_pitch_up':
-            self.render.rotateCamera(y=-1)
-        elif name == 'camera_pitch_down':
-            self.render.rotateCamera(y=1)
-        elif name == 'camera_roll_left':
-            self.render.rotateCamera(z=1)
-        elif name == 'camera_roll_right':
-            self.render.rotateCamera(z=-1)
-        elif name == 'camera_move_back_x':
-            self.render.toggleCameraMoveBackX()
-        elif name == 'camera_move_back_y':
-            self.render.toggleCameraMoveBackY()
-        elif name == 'camera_move_back_z':
-            self.render.toggleCameraMoveBackZ()
-        elif name == 'camera_lock_x':
-            self.render.cameraLockX = not self.render.cameraLockX
-        elif name == 'camera_lock_y':
-            self.render.cameraLockY = not self.render.cameraLockY
-        elif name == 'camera_lock_z':
-            self.render.cameraLockZ = not self.render.cameraLockZ
-        elif name == 'camera_attach':
-            self.render.cameraAttached = not self.render.cameraAttached
-        elif name == 'camera_fov_up':
-            self.render.fieldOfView = self.render.fieldOfView * 1.05
-        elif name == 'camera_fov_down':
-            self.render.fieldOfView = self.render.fieldOfView * 0.95
-        elif name == 'render_dof_near_up':
-            self.render.depthOfFieldNear = self.render.depthOfFieldNear * 1.05
-        elif name == 'render_dof_near_down':
-            self.render.depthOfFieldNear = self.render.depthOfFieldNear * 0.95
-        elif name == 'render_dof_mid_up':
-            self.render.depthOfFieldMid = self.render.depthOfFieldMid * 1.05
-        elif name == 'render_dof_mid_down':
-            self.render.depthOfFieldMid = self.render.depthOfFieldMid * 0.95
-        elif name == 'render_dof_far_up':
-            self.render.depthOfFieldFar = self.render.depthOfFieldFar * 1.05
-        elif name == 'render_dof_far_down':
-            self.render.depthOfFieldFar = self.render.depthOfFieldFar * 0.95
-        elif name == 'play_pause':
-            self.playback.paused = not self.playback.paused
-        elif name == 'time_minus_120':
-            self.playback.adjustTime(-120)
-        elif name == 'time_minus_60':
-            self.playback.adjustTime(-60)
-        elif name == 'time_minus_30':
-            self.playback.adjustTime(-30)
-        elif name == 'time_minus_10':
-            self.playback.adjustTime(-10)
-        elif name == 'time_minus_5':
-            self.playback.adjustTime(-5)
-        elif name == 'time_plus_5':
-            self.playback.adjustTime(5)
-        elif name == 'time_plus_10':
-            self.playback.adjustTime(10)
-        elif name == 'time_plus_30':
-            self.playback.adjustTime(30)
-        elif name == 'time_plus_60':
-            self.playback.adjustTime(60)
-        elif name == 'time_plus_120':
-            self.playback.adjustTime(120)
-
-
 class ConnectWindow(QDialog):
     def __init__(self):
         QDialog.__init__(self)
@@ -859,8 +1056,13 @@ class ConnectWindow(QDialog):
         self.layout.addWidget(self.welcome)
         self.list = QListWidget()
         self.list.itemChanged.connect(self.itemChanged)
-        self.list.setSortingEnabled(False)
+        self.list.setSortingEnabled(True)
         self.layout.addWidget(self.list)
+        self.items = {}
+        self.discovery = GameDiscovery()
+        self.discovery.found.connect(self.updateItem)
+        self.discovery.done.connect(self.discoveryDone)
+        self.reloadPending = False
         self.reload()
 
     def sizeHint(self):
@@ -871,22 +1073,42 @@ class ConnectWindow(QDialog):
         checked = item.checkState() == Qt.Checked
         if checked != isGameEnabled(path):
             setGameEnabled(path, checked)
-            self.reload()
+            self.updateItem(path, isGameEnabled(path))
 
     def reload(self):
-        self.list.clear()
-        for path in findInstalledGames():
-            enabled = isGameEnabled(path)
-            item = QListWidgetItem(path)
+        """
+        Show the games found last time straight away and look for new ones
+        in the background.
+        """
+        for path in cache.paths():
+            self.updateItem(path, isGameEnabled(path))
+        if self.discovery.isRunning():
+            self.reloadPending = True
+        else:
+            self.discovery.start()
+
+    def discoveryDone(self, paths):
+        for path in set(self.items) - set(paths):
+            self.list.takeItem(self.list.row(self.items.pop(path)))
+        if self.reloadPending:
+            self.reloadPending = False
+            self.reload()
+
+    def updateItem(self, path, enabled):
+        item = self.items.get(path)
+        if item is None:
+            item = self.items[path] = QListWidgetItem(path)
             item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-            item.setCheckState(Qt.Checked if enabled else Qt.Unchecked)
             item.setBackground(QApplication.palette().alternateBase())
             item.setStatusTip('游戏状态')
-            font = item.font()
-            font.setPointSize(14)
-            font.setBold(enabled)
-            item.setFont(font)
             self.list.addItem(item)
+        self.list.blockSignals(True)
+        item.setCheckState(Qt.Checked if enabled else Qt.Unchecked)
+        font = item.font()
+        font.setPointSize(14)
+        font.setBold(enabled)
+        item.setFont(font)
+        self.list.blockSignals(False)
 
 
 class UpdateWindow(QDialog):
@@ -943,10 +1165,12 @@ class LeagueDirector(object):
         self.bindings.triggered.connect(self.windows['visible'].onKeybinding)
         self.timerUpdate = schedule(500, self.update)
         self.timerSave = schedule(5000, self.saveSettings)
+        self.api.start()
         self.update()
 
     def closeEvent(self, event):
         self.saveSettings()
+        self.settings.flush(wait=True)
         QMainWindow.closeEvent(self.window, event)
 
     def setupLogging(self):
@@ -1106,7 +1330,6 @@ class LeagueDirector(object):
         widget.update()
 
     def update(self):
-        self.api.update()
         self.bindings.setGamePid(self.api.game.processID)
         for name, window in self.windows.items():
             if name == 'update':
@@ -1144,6 +1367,7 @@ class LeagueDirector(object):
             self.settings.setValue('{}/geo'.format(name), parent.geometry().getRect())
             if hasattr(widget, 'saveSettings'):
                 self.settings.setValue('{}/settings'.format(name), widget.saveSettings())
+        self.settings.flush()
 
     def loadTheme(self):
         palette = QPalette()
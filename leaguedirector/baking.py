@@ -0,0 +1,249 @@
+import math
+from PySide6.QtCore import *
+from leaguedirector.interpolation import Curve, blendFunctions
+
+# Blends tried when fitting a span, simplest first so plain moves stay linear.
+# Blends that overshoot or bounce are left out, freehand moves never do that.
+bakeBlends = [
+    'linear',
+    'smoothStep',
+    'sineEaseInOut',
+    'sineEaseIn',
+    'sineEaseOut',
+    'quadraticEaseIn',
+    'quadraticEaseOut',
+    'quadraticEaseInOut',
+    'cubicEaseIn',
+    'cubicEaseOut',
+    'cubicEaseInOut',
+    'smootherStep',
+]
+
+
+def positionError(a, b):
+    return math.sqrt(sum((x - y) ** 2 for x, y in zip(a, b)))
+
+
+def angleError(a, b):
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+def unwrapAngles(values):
+    """
+    Keep every angle within half a turn of the one before it, so a camera
+    turning past 360 degrees keeps turning instead of spinning back.
+    """
+    result = []
+    previous = None
+    for value in values:
+        if previous is not None:
+            value = tuple(v + 360 * round((p - v) / 360) for v, p in zip(value, previous))
+        result.append(value)
+        previous = value
+    return result
+
+
+def spanError(times, values, first, last, function, error, tolerance=None):
+    """
+    Largest error of the samples between first and last when they are
+    replaced by a single segment eased with function. Stops early once the
+    error is past tolerance.
+    """
+    a = values[first]
+    b = values[last]
+    start = times[first]
+    span = times[last] - start
+    worst = 0.0
+    for index in range(first + 1, last):
+        p = function((times[index] - start) / span) if span > 0 else 1.0
+        worst = max(worst, error(tuple(x + (y - x) * p for x, y in zip(a, b)), values[index]))
+        if tolerance is not None and worst > tolerance:
+            break
+    return worst
+
+
+def fitSpan(times, values, first, last, tolerance, error, blends):
+    for name in blends:
+        if spanError(times, values, first, last, blendFunctions[name], error, tolerance) <= tolerance:
+            return name
+
+
+def simplify(times, values, tolerance, error=positionError, blends=bakeBlends, breaks=None):
+    """
+    Pick the samples to keep as keyframes and the blend of each so that
+    easing between them reproduces every sample within tolerance. From
+    every kept sample the next one is the furthest a single blend can
+    reach, found by doubling the reach and then bisecting. Returns a list
+    of sample index and blend pairs.
+
+    Breaks limits the keys to a list of sample index and blend pairs, the
+    span between two neighbouring breaks keeps the blend of its first.
+    """
+    count = len(times)
+    if breaks is None:
+        breaks = [(index, 'linear') for index in range(count)]
+    if len(breaks) <= 2:
+        return list(breaks)
+    last = len(breaks) - 1
+    def fit(first, end):
+        return fitSpan(times, values, breaks[first][0], breaks[end][0], tolerance, error, blends)
+    keys = []
+    first = 0
+    while first < last:
+        # Neighbouring breaks always fit with their own blend
+        reach, blend = first + 1, breaks[first][1]
+        step = 2
+        failed = None
+        while reach < last:
+            end = min(first + step, last)
+            found = fit(first, end)
+            if found is None:
+                failed = end
+                break
+            reach, blend = end, found
+            step *= 2
+        if failed is not None:
+            lower, upper = reach, failed
+            while upper - lower > 1:
+                middle = (lower + upper) // 2
+                found = fit(first, middle)
+                if found is None:
+                    upper = middle
+                else:
+                    lower, blend = middle, found
+            reach = lower
+        keys.append((breaks[first][0], blend))
+        first = reach
+    keys.append(breaks[last])
+    return keys
+
+
+def bakeSamples(times, values, components, tolerance, error=positionError, breaks=None):
+    """
+    Keyframes for a path given as samples, values are tuples of components.
+    """
+    return [
+        {'time': times[index], 'value': dict(zip(components, values[index])), 'blend': blend}
+        for index, blend in simplify(times, values, tolerance, error, breaks=breaks)
+    ]
+
+
+def bakeKeyframes(keyframes, tolerance, error=positionError, rate=30.0):
+    """
+    Fewest keyframes that follow the curve of an existing vector track
+    within tolerance. Only the existing keyframes are kept or dropped so
+    the result never grows, spans are checked against the curve sampled
+    at rate so blends between the original keyframes are honoured.
+    """
+    curve = Curve(keyframes)
+    if len(curve) <= 2 or curve.components is None:
+        return [dict(keyframe) for keyframe in keyframes]
+    blends = {keyframe['time']: keyframe.get('blend', 'linear') for keyframe in sorted(keyframes, key=lambda item: item['time'])}
+    start, end = curve.times[0], curve.times[-1]
+    steps = int((end - start) * rate)
+    times = sorted(set(curve.times) | set(start + index / rate for index in range(1, steps)))
+    values = [tuple(value[name] for name in curve.components) for value in curve.sample(times)]
+    breaks = [(index, blends[time]) for index, time in enumerate(times) if time in blends]
+    return bakeSamples(times, values, curve.components, tolerance, error, breaks)
+
+
+class CameraRecorder(QObject):
+    """
+    Captures the camera while the replay plays so a freehand move can be
+    baked into a small set of keyframes afterwards. The render resource is
+    polled at the capture rate for as long as the recorder runs and every
+    state it returns is stamped with the replay time it belongs to.
+    """
+    components = ('x', 'y', 'z')
+
+    def __init__(self, api, interval=33):
+        QObject.__init__(self)
+        self.render = api.render
+        self.playback = api.playback
+        self.sequence = api.sequence
+        self.interval = interval
+        self.times = []
+        self.positions = []
+        self.rotations = []
+        self.timestamp = None
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.capture)
+
+    @property
+    def recording(self):
+        return self.timer.isActive()
+
+    def start(self):
+        self.times = []
+        self.positions = []
+        self.rotations = []
+        self.timestamp = self.render.timestamp
+        self.render.captureInterval = self.interval
+        self.render.capturing = True
+        self.render.update()
+        self.timer.start(self.interval)
+
+    def stop(self):
+        self.timer.stop()
+        self.render.capturing = False
+
+    def replayTime(self):
+        """
+        Replay time at which the game sent the current render state.
+        """
+        playback = self.playback
+        if playback.paused:
+            return playback.time
+        return min(playback.time + (self.render.timestamp - playback.timestamp) * playback.speed, playback.length)
+
+    def capture(self):
+        # Only a fresh reply from a running replay is a new sample
+        if self.render.timestamp == self.timestamp or self.playback.paused or self.playback.seeking:
+            return
+        self.timestamp = self.render.timestamp
+        time = self.replayTime()
+        if self.times and time <= self.times[-1]:
+            return
+        self.times.append(time)
+        self.positions.append(tuple(self.render.cameraPosition[name] for name in self.components))
+        self.rotations.append(tuple(self.render.cameraRotation[name] for name in self.components))
+
+    def bake(self, positionTolerance, angleTolerance):
+        """
+        Replace the camera keyframes within the captured time range by the
+        fewest keyframes that follow the captured path within tolerance.
+        Returns how many samples and keyframes there were.
+        """
+        if len(self.times) < 2:
+            return 0, 0
+        start, end = self.times[0], self.times[-1]
+        position = bakeSamples(self.times, self.positions, self.components, positionTolerance, positionError)
+        rotation = bakeSamples(self.times, unwrapAngles(self.rotations), self.components, angleTolerance, angleError)
+        with self.sequence.transaction():
+            self.sequence.replaceKeyframes('cameraPosition', position, start, end)
+            self.sequence.replaceKeyframes('cameraRotation', rotation, start, end)
+        return len(self.times), len(position) + len(rotation)
+
+
+def simplifyCamera(sequence, positionTolerance, angleTolerance):
+    """
+    Simplify the camera tracks of a sequence in place, a track is only
+    replaced when that saves keyframes. Returns how many keyframes there
+    were before and after.
+    """
+    before = after = 0
+    changes = []
+    for name, tolerance, error in (('cameraPosition', positionTolerance, positionError), ('cameraRotation', angleTolerance, angleError)):
+        keyframes = list(sequence.getKeyframes(name))
+        baked = bakeKeyframes(keyframes, tolerance, error)
+        before += len(keyframes)
+        if len(baked) < len(keyframes):
+            changes.append((name, baked))
+            after += len(baked)
+        else:
+            after += len(keyframes)
+    if changes:
+        with sequence.transaction():
+            for name, baked in changes:
+                sequence.replaceKeyframes(name, baked)
+    return before, after
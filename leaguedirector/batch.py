@@ -0,0 +1,461 @@
+import os
+import sys
+import json
+import time
+import shlex
+import logging
+import argparse
+import functools
+import subprocess
+from PySide6.QtCore import *
+from leaguedirector.widgets import userpath
+from leaguedirector.storage import Journal
+from leaguedirector.api import Api, Endpoint
+from leaguedirector.segments import SegmentedRecording
+from leaguedirector.telemetry import RenderTelemetry
+
+
+class RenderJob(object):
+    """
+    One clip to render: the sequence to play over a replay and how to
+    encode it. Without a time range the whole sequence is rendered. With a
+    segment length the range is recorded in resumable segments into a
+    directory named after the job.
+    """
+
+    def __init__(self, name, sequence, replay=None, codec='webm', fps=60, startTime=None, endTime=None, lossless=False, output=None, retries=None, segment=0):
+        self.name = name
+        self.sequence = sequence
+        self.replay = replay
+        self.codec = codec
+        self.fps = fps
+        self.startTime = startTime
+        self.endTime = endTime
+        self.lossless = lossless
+        self.output = output
+        self.retries = retries
+        self.segment = segment
+        self.attempts = 0
+
+    def data(self):
+        data = dict(self.__dict__)
+        del data['attempts']
+        return data
+
+    @classmethod
+    def fromData(cls, data, index=0):
+        data = dict(data)
+        if 'sequence' not in data:
+            raise ValueError('Job {} has no sequence'.format(index))
+        data.setdefault('name', '{:03}-{}'.format(index, os.path.splitext(os.path.basename(data['sequence']))[0]))
+        return cls(**data)
+
+
+def loadJobs(path):
+    """
+    Read a job queue, either a json list or one json object per line.
+    """
+    with open(path, 'r') as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        entries = json.loads(text)
+    else:
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    directory = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for index, entry in enumerate(entries):
+        job = RenderJob.fromData(entry, index)
+        # Paths in the queue are relative to the queue file
+        job.sequence = os.path.join(directory, job.sequence)
+        if job.replay:
+            job.replay = os.path.join(directory, job.replay)
+        jobs.append(job)
+    return jobs
+
+
+def completedJobs(path):
+    """
+    Names of the jobs a previous run already rendered according to its stats.
+    """
+    return set(entry['job'] for entry in Journal(path).replay() if entry.get('status') == 'done')
+
+
+class BatchRenderer(QObject):
+    """
+    Renders jobs from a queue back to back on one game client without
+    anyone at the keyboard. Every job goes through three stages, each with
+    its own timeout: wait for the game, upload the sequence, record. Failed
+    jobs go back to the front of the queue so any client can retry
+    them, and every attempt is appended to the stats file.
+    """
+    finished = Signal()
+
+    def __init__(self, jobs, stats, endpoint=None, output=None, launch=None, retries=2, retryDelay=5, connectTimeout=600, startTimeout=60, stallTimeout=60, telemetry=None):
+        QObject.__init__(self)
+        self.jobs = jobs
+        self.stats = Journal(stats)
+        self.api = Api(endpoint)
+        self.endpoint = self.api.endpoint
+        self.output = output or userpath('recordings')
+        self.launch = launch
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.connectTimeout = connectTimeout
+        self.startTimeout = startTimeout
+        self.stallTimeout = stallTimeout
+        self.game = self.api.game
+        self.playback = self.api.playback
+        self.recording = self.api.recording
+        self.sequence = self.api.sequence
+        self.process = None
+        self.processReplay = None
+        self.job = None
+        self.state = None
+        self.segments = None
+        self.telemetry = RenderTelemetry(telemetry)
+        self.results = []
+        self.started = None
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.tick)
+        self.retryTimer = QTimer()
+        self.retryTimer.setSingleShot(True)
+        self.retryTimer.timeout.connect(self.nextJob)
+
+    def start(self):
+        self.started = time.time()
+        self.game.startPolling()
+        self.playback.startPolling()
+        self.recording.startPolling()
+        self.timer.start(100)
+        self.nextJob()
+
+    def stop(self):
+        self.timer.stop()
+        self.retryTimer.stop()
+        for resource in (self.game, self.playback, self.recording):
+            resource.stopPolling()
+        self.sequence.setSequencing(False)
+        self.stopProcess()
+        self.finished.emit()
+
+    def nextJob(self):
+        self.state = None
+        if not self.jobs:
+            self.job = None
+            logging.info('No jobs left for %s', self.endpoint.host)
+            self.stop()
+            return
+        self.job = self.jobs.pop(0)
+        self.job.attempts += 1
+        self.times = {'started': time.time()}
+        self.segments = None
+        logging.info('Job %s attempt %d on %s', self.job.name, self.job.attempts, self.endpoint.host)
+        try:
+            self.launchReplay()
+        except OSError as error:
+            self.fail('Could not launch replay: {}'.format(error))
+            return
+        self.setState('connect')
+
+    def setState(self, state):
+        self.state = state
+        self.stateStarted = time.time()
+
+    def elapsed(self):
+        return time.time() - self.stateStarted
+
+    def tick(self):
+        if self.state == 'connect':
+            self.tickConnect()
+        elif self.state == 'upload':
+            self.tickUpload()
+        elif self.state == 'record' and self.segments.active:
+            self.telemetry.sample(self.segments.startTime + self.segments.currentTime)
+
+    def launchReplay(self):
+        """
+        Start the game on the job's replay when a launch command was given
+        and the replay differs from the one already running.
+        """
+        if not self.launch or not self.job.replay:
+            return
+        if self.process is not None and self.process.poll() is None and self.processReplay == self.job.replay:
+            return
+        self.stopProcess()
+        url = QUrl(self.endpoint.host)
+        command = [part.format(replay=self.job.replay, host=url.host(), port=url.port()) for part in shlex.split(self.launch)]
+        logging.info('Launching %s', ' '.join(command))
+        self.process = subprocess.Popen(command)
+        self.processReplay = self.job.replay
+
+    def stopProcess(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                self.process.wait()
+            self.process = None
+            self.processReplay = None
+
+    def tickConnect(self):
+        # Only trust a reply that arrived after we started waiting, and when
+        # we launched the game make sure it is that process answering
+        ready = not self.game.failures and self.game.timestamp > self.stateStarted
+        if ready and self.process is not None:
+            ready = self.game.processID == self.process.pid
+        if ready:
+            self.times['connected'] = time.time()
+            self.uploadSequence()
+        elif self.process is not None and self.process.poll() is not None:
+            self.fail('Game exited with code {}'.format(self.process.returncode))
+        elif self.elapsed() > self.connectTimeout:
+            self.fail('Timed out waiting for the game')
+
+    def uploadSequence(self):
+        directory, filename = os.path.split(self.job.sequence)
+        name, extension = os.path.splitext(filename)
+        if not os.path.isfile(self.job.sequence):
+            self.fail('Sequence {} does not exist'.format(self.job.sequence))
+            return
+        # Jobs are read only, load the exact file the job names without
+        # converting or saving anything
+        for format, suffix in self.sequence.extensions.items():
+            if suffix == extension:
+                self.sequence.setFormat(format)
+        self.sequence.directory = directory
+        self.sequence.loadFile(name, compact=False)
+        self.sequence.synced = False
+        self.sequence.setSequencing(True)
+        self.setState('upload')
+
+    def tickUpload(self):
+        if self.sequence.saveRemoteTimer.isActive() or self.sequence.writing is not None:
+            if self.elapsed() > self.connectTimeout:
+                self.fail('Timed out uploading the sequence')
+        elif self.sequence.synced:
+            self.times['uploaded'] = time.time()
+            self.startRecording()
+        elif self.elapsed() > self.connectTimeout:
+            self.fail('Could not upload the sequence')
+        else:
+            self.sequence.resync()
+
+    def startRecording(self):
+        startTime = self.job.startTime if self.job.startTime is not None else self.sequence.startTime
+        endTime = self.job.endTime if self.job.endTime is not None else self.sequence.endTime
+        if startTime is None or endTime is None or endTime <= startTime:
+            self.fail('Sequence has no time range to render')
+            return
+        self.range = (startTime, endTime)
+        output = self.job.output or self.output
+        if self.job.segment:
+            output = os.path.join(output, self.job.name)
+        self.segments = SegmentedRecording(
+            self.api, output, self.job.codec, self.job.fps, startTime, endTime, self.job.segment,
+            self.job.lossless, 0, self.startTimeout, self.stallTimeout,
+        )
+        self.segments.progressed.connect(self.recordingStarted)
+        # Queued, completing starts the next job or quits the batch which
+        # must not happen while the recording is still emitting finished
+        self.segments.finished.connect(self.complete, Qt.QueuedConnection)
+        self.segments.failed.connect(self.fail)
+        self.setState('record')
+        self.segments.start()
+        self.telemetry.start(
+            self.job.codec, self.job.fps, startTime, endTime, self.job.lossless,
+            resumed=self.segments.resumedTime(), segment=self.job.segment, job=self.job.name, endpoint=self.endpoint.host,
+        )
+
+    def recordingStarted(self):
+        self.times.setdefault('recording', time.time())
+
+    def complete(self):
+        self.times.setdefault('recording', self.times['uploaded'])
+        self.times['done'] = time.time()
+        self.finishAttempt('done')
+        self.nextJob()
+
+    def fail(self, error):
+        logging.error('Job %s attempt %d on %s failed: %s', self.job.name, self.job.attempts, self.endpoint.host, error)
+        if self.segments is not None:
+            self.segments.stop()
+        self.times['done'] = time.time()
+        self.finishAttempt('failed', error)
+        retries = self.job.retries if self.job.retries is not None else self.retries
+        if self.job.attempts <= retries:
+            self.jobs.insert(0, self.job)
+        # Give the game a moment to recover before taking the next job
+        self.state = None
+        self.retryTimer.start(int(self.retryDelay * 1000))
+
+    def finishAttempt(self, status, error=None):
+        self.telemetry.finish(status, width=self.recording.width, height=self.recording.height)
+        times = self.times
+        def duration(start, end):
+            if start in times and end in times:
+                return round(times[end] - times[start], 3)
+        result = {
+            'job': self.job.name,
+            'attempt': self.job.attempts,
+            'endpoint': self.endpoint.host,
+            'status': status,
+            'error': error,
+            'replay': self.job.replay,
+            'sequence': self.job.sequence,
+            'codec': self.job.codec,
+            'fps': self.job.fps,
+            'path': self.recordingPath(),
+            'connect': duration('started', 'connected'),
+            'upload': duration('connected', 'uploaded'),
+            'start': duration('uploaded', 'recording'),
+            'render': duration('recording', 'done'),
+            'total': duration('started', 'done'),
+            'timestamp': times['done'],
+        }
+        if status == 'done':
+            length = self.range[1] - self.range[0]
+            result['startTime'], result['endTime'] = self.range
+            result['frames'] = int(length * self.job.fps)
+            result['realtime'] = round(length / max(result['render'], 0.001), 3)
+            result['segments'] = len(self.segments.segments)
+            result['resumed'] = self.segments.resumed
+            logging.info('Job %s rendered %.1fs of video in %.1fs', self.job.name, length, result['render'])
+        self.sequence.setSequencing(False)
+        self.results.append(result)
+        self.stats.append(result)
+
+    def recordingPath(self):
+        if self.segments is not None and self.segments.segmented:
+            return self.segments.manifestPath()
+        return self.recording.path
+
+    def throughput(self):
+        """
+        What this client rendered so far, realtime is seconds of video
+        rendered per second of wall clock since the batch started.
+        """
+        done = [result for result in self.results if result['status'] == 'done']
+        video = sum(result['endTime'] - result['startTime'] for result in done)
+        elapsed = max(time.time() - self.started, 0.001) if self.started else 0.001
+        return {
+            'state': self.state or ('idle' if self.job is None else 'waiting'),
+            'job': self.job.name if self.job is not None else None,
+            'rendered': len(done),
+            'failed': len(self.results) - len(done),
+            'video': round(video, 3),
+            'frames': sum(result['frames'] for result in done),
+            'realtime': round(video / elapsed, 3),
+        }
+
+
+class BatchController(QObject):
+    """
+    Fans one job queue out across several game clients, each driven by
+    its own renderer, and periodically reports the health and throughput
+    of every endpoint.
+    """
+    finished = Signal()
+
+    def __init__(self, jobs, stats, endpoints, health=None, reportInterval=60, **options):
+        QObject.__init__(self)
+        self.jobs = list(jobs)
+        self.total = set(job.name for job in self.jobs)
+        self.health = Journal(health) if health else None
+        self.renderers = [BatchRenderer(self.jobs, stats, endpoint, **options) for endpoint in endpoints]
+        self.running = set()
+        for renderer in self.renderers:
+            renderer.finished.connect(functools.partial(self.rendererFinished, renderer))
+        self.reportTimer = QTimer()
+        self.reportTimer.timeout.connect(self.report)
+        self.reportInterval = reportInterval
+
+    def start(self):
+        for renderer in self.renderers:
+            self.running.add(renderer)
+            renderer.start()
+        self.reportTimer.start(int(self.reportInterval * 1000))
+
+    def rendererFinished(self, renderer):
+        self.running.discard(renderer)
+        if not self.running:
+            self.reportTimer.stop()
+            self.report()
+            logging.info('Batch finished, %d of %d jobs rendered', len(self.rendered()), len(self.total))
+            self.finished.emit()
+
+    def rendered(self):
+        return set(result['job'] for renderer in self.renderers for result in renderer.results if result['status'] == 'done')
+
+    def report(self):
+        for renderer in self.renderers:
+            entry = dict(renderer.endpoint.health(), **renderer.throughput())
+            entry['timestamp'] = time.time()
+            logging.info(
+                '%s %s, %d rendered, %d failed, %.2fx realtime, %d requests, %.1f%% errors, p50 %s ms',
+                entry['host'], 'connected' if entry['connected'] else 'offline', entry['rendered'],
+                entry['failed'], entry['realtime'], entry['requests'], entry['errorRate'] * 100, entry['p50'],
+            )
+            if self.health is not None:
+                self.health.append(entry)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render a queue of sequences without the League Director window.')
+    parser.add_argument('jobs', help='json list or json lines file of jobs')
+    parser.add_argument('--host', action='append', help='replay api to render with, repeat to render on several clients at once')
+    parser.add_argument('--output', help='directory recordings are written to unless a job says otherwise')
+    parser.add_argument('--stats', help='json lines file every attempt is appended to')
+    parser.add_argument('--health', help='json lines file the endpoint reports are appended to')
+    parser.add_argument('--telemetry', help='json lines file a summary of every render is appended to')
+    parser.add_argument('--report', type=float, default=60, help='seconds between endpoint reports')
+    parser.add_argument('--launch', help='command starting the game on a replay, {replay}, {host} and {port} are filled in')
+    parser.add_argument('--retries', type=int, default=2, help='attempts after the first before a job is given up')
+    parser.add_argument('--retry-delay', type=float, default=5, help='seconds to wait before retrying')
+    parser.add_argument('--connect-timeout', type=float, default=600, help='seconds to wait for the game')
+    parser.add_argument('--start-timeout', type=float, default=60, help='seconds to wait for a recording to start')
+    parser.add_argument('--stall-timeout', type=float, default=60, help='seconds a recording may make no progress')
+    parser.add_argument('--skip-done', action='store_true', help='skip jobs the stats file lists as rendered')
+    parser.add_argument('--mock', type=int, nargs='?', const=1, default=0, help='render against this many local mock replay apis')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)-8s] %(message)s')
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+
+    stats = args.stats or userpath('logs', 'batch.jsonl')
+    jobs = loadJobs(args.jobs)
+    if args.skip_done:
+        done = completedJobs(stats)
+        jobs = [job for job in jobs if job.name not in done]
+    if not jobs:
+        logging.info('Nothing to render')
+        return 0
+
+    hosts = list(args.host or [])
+    servers = []
+    if args.mock:
+        from leaguedirector.mock import MockGame, MockServer
+        servers = [MockServer(MockGame(), port=0).start() for _ in range(args.mock)]
+        hosts += [server.url for server in servers]
+    endpoints = [Endpoint(host) for host in hosts or [Endpoint.defaultHost]]
+
+    controller = BatchController(
+        jobs, stats, endpoints, args.health or userpath('logs', 'batch-health.jsonl'), args.report,
+        output=args.output, launch=args.launch, retries=args.retries, retryDelay=args.retry_delay,
+        connectTimeout=args.connect_timeout, startTimeout=args.start_timeout, stallTimeout=args.stall_timeout,
+        telemetry=args.telemetry,
+    )
+    controller.finished.connect(app.quit)
+    QTimer.singleShot(0, controller.start)
+    app.exec()
+    for server in servers:
+        server.stop()
+    return 0 if controller.rendered() == controller.total else 1
+
+
+if __name__ == '__main__':
+    code = main()
+    # Skip interpreter teardown, some PySide6 releases drop a reference to
+    # a bool on every signal emit and a long batch can run that count out,
+    # which aborts garbage collection at exit and hides the exit code
+    logging.shutdown()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
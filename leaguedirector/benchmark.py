@@ -0,0 +1,241 @@
+import sys
+import time
+import random
+import logging
+import argparse
+import functools
+import statistics
+from PySide6.QtCore import *
+from PySide6.QtNetwork import *
+from leaguedirector.api import Endpoint, Resource, Game, Render, Particles, Playback, Recording, Sequence
+from leaguedirector.mock import MockGame, MockServer
+from leaguedirector.interpolation import Curve
+from leaguedirector import codec
+
+
+def percentile(samples, percent):
+    if len(samples) < 2:
+        return samples[0] if samples else 0
+    return statistics.quantiles(samples, n=100, method='inclusive')[percent - 1]
+
+
+def report(name, stats):
+    print('{:<12} {:>8} req {:>10.1f} req/s {:>9.2f} ms p50 {:>9.2f} ms p99 {:>12.1f} KB/s {:>5} errors'.format(
+        name,
+        stats['requests'],
+        stats['rate'],
+        stats['p50'] * 1000,
+        stats['p99'] * 1000,
+        stats['throughput'] / 1024,
+        stats['errors'],
+    ))
+
+
+class ResourceBenchmark(QObject):
+    """
+    Drives Resource.update() against a replay api and records the round
+    trip of each reply. Every resource instance keeps exactly one request
+    outstanding, concurrency controls how many instances run side by side.
+    """
+
+    def __init__(self, resources, requests, data=None):
+        QObject.__init__(self)
+        self.resources = resources
+        self.remaining = requests
+        self.data = data
+        self.samples = []
+        self.received = 0
+        self.errors = 0
+        self.active = 0
+        self.loop = QEventLoop()
+
+    def run(self):
+        started = time.perf_counter()
+        for resource in self.resources:
+            self.send(resource)
+        if self.active:
+            self.loop.exec()
+        elapsed = time.perf_counter() - started
+        return {
+            'requests': len(self.samples),
+            'elapsed': elapsed,
+            'rate': len(self.samples) / elapsed,
+            'p50': percentile(self.samples, 50),
+            'p99': percentile(self.samples, 99),
+            'throughput': self.received / elapsed,
+            'errors': self.errors,
+        }
+
+    def send(self, resource):
+        if self.remaining <= 0:
+            return
+        self.remaining -= 1
+        self.active += 1
+        started = time.perf_counter()
+        response = Resource.update(resource, self.data)
+        response.finished.connect(functools.partial(self.finished, resource, response, started))
+
+    def finished(self, resource, response, started):
+        self.samples.append(time.perf_counter() - started)
+        self.active -= 1
+        if response.error() == QNetworkReply.NoError:
+            self.received += int(response.header(QNetworkRequest.ContentLengthHeader) or 0)
+        else:
+            self.errors += 1
+        response.deleteLater()
+        self.send(resource)
+        if self.active == 0:
+            self.loop.quit()
+
+
+def createResource(name, endpoint):
+    if name == 'game':
+        return Game(endpoint)
+    if name == 'render':
+        return Render(endpoint)
+    if name == 'particles':
+        return Particles(endpoint)
+    if name == 'playback':
+        return Playback(endpoint)
+    if name == 'recording':
+        return Recording(endpoint)
+    if name == 'sequence':
+        return Sequence(Render(endpoint), Playback(endpoint))
+
+
+def createPayload(name, keyframes):
+    if name == 'render':
+        return {'fieldOfView': 45.0, 'cameraPosition': {'x': 100.0, 'y': 200.0, 'z': 300.0}}
+    if name == 'playback':
+        return {'speed': 1.0}
+    if name == 'sequence':
+        return {
+            'cameraPosition': [
+                {'time': index / 10.0, 'value': {'x': index * 1.5, 'y': 500.0, 'z': index * -2.5}, 'blend': 'linear'}
+                for index in range(keyframes)
+            ],
+            'fieldOfView': [
+                {'time': index / 10.0, 'value': 40.0 + index % 20, 'blend': 'cubicEaseInOut'}
+                for index in range(keyframes)
+            ],
+        }
+    return None
+
+
+def benchmarkResources(args):
+    server = None
+    if args.host is None:
+        game = MockGame(particles=args.particles)
+        server = MockServer(game, port=0, delay=args.delay, padding=args.padding).start()
+        endpoint = Endpoint(server.url)
+    else:
+        endpoint = Endpoint(args.host)
+    print('Benchmarking {} ({} requests, concurrency {})'.format(endpoint.host, args.requests, args.concurrency))
+    for name in args.resources:
+        resources = [createResource(name, endpoint) for _ in range(args.concurrency)]
+        data = createPayload(name, args.keyframes) if args.post or name == 'sequence' else None
+        report(name, ResourceBenchmark(resources, args.requests, data).run())
+    if server is not None:
+        server.stop()
+
+
+def createTrack(name, count, length):
+    times = sorted(random.uniform(0, length) for _ in range(count))
+    keyframes = []
+    for when in times:
+        if name.endswith('Enabled'):
+            value = random.random() > 0.5
+        elif name.endswith('Color'):
+            value = {'r': random.random(), 'g': random.random(), 'b': random.random(), 'a': random.random()}
+        elif name in ('cameraPosition', 'cameraRotation', 'sunDirection'):
+            value = {'x': random.uniform(0, 15000), 'y': random.uniform(0, 2000), 'z': random.uniform(0, 15000)}
+        else:
+            value = random.uniform(0, 100)
+        keyframes.append({'time': when, 'value': value, 'blend': random.choice(Sequence.blendOptions)})
+    return keyframes
+
+
+def benchmarkInterpolation(args):
+    random.seed(args.seed)
+    frames = int(args.length * args.fps)
+    times = [frame / float(args.fps) for frame in range(frames)]
+    print('Sampling {} tracks with {} keyframes at {} fps over {:.0f} s ({} frames)'.format(
+        len(Sequence.fields), args.keyframes, args.fps, args.length, frames))
+    total = 0
+    for name in Sequence.fields:
+        keyframes = createTrack(name, args.keyframes, args.length)
+        started = time.perf_counter()
+        Curve(keyframes).sample(times)
+        elapsed = time.perf_counter() - started
+        total += elapsed
+        print('{:<20} {:>9.1f} ms {:>12.0f} samples/s'.format(name, elapsed * 1000, frames / elapsed))
+    print('{:<20} {:>9.1f} ms {:>12.0f} samples/s'.format('total', total * 1000, frames * len(Sequence.fields) / total))
+
+
+def benchmarkCodecs(args):
+    game = MockGame(particles=args.particles)
+    payloads = {
+        'render': game.get(Render.url),
+        'particles': game.get(Particles.url),
+        'sequence': createPayload('sequence', args.keyframes),
+    }
+    print('Encoding and decoding each payload {} times with {}'.format(args.iterations, ', '.join(codec.codecs)))
+    for name, payload in payloads.items():
+        for backend in codec.codecs.values():
+            started = time.perf_counter()
+            for _ in range(args.iterations):
+                body = backend.encode(payload)
+            encoding = (time.perf_counter() - started) / args.iterations
+            reply = QByteArray(body)
+            started = time.perf_counter()
+            for _ in range(args.iterations):
+                backend.decode(reply)
+            decoding = (time.perf_counter() - started) / args.iterations
+            print('{:<10} {:<7} {:>9.1f} KB {:>9.3f} ms encode {:>9.1f} MB/s {:>9.3f} ms decode {:>9.1f} MB/s'.format(
+                name,
+                backend.name,
+                len(body) / 1024,
+                encoding * 1000,
+                len(body) / encoding / 1024 / 1024,
+                decoding * 1000,
+                len(body) / decoding / 1024 / 1024,
+            ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='League Director benchmarks.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    resources = commands.add_parser('resources', help='request rate and round trip of the replay api resources')
+    resources.add_argument('resources', nargs='*', default=['game', 'render', 'particles', 'playback', 'recording'])
+    resources.add_argument('--host', help='replay api to measure, a local mock server is started when omitted')
+    resources.add_argument('--requests', type=int, default=500)
+    resources.add_argument('--concurrency', type=int, default=1)
+    resources.add_argument('--post', action='store_true', help='send writes instead of polling')
+    resources.add_argument('--delay', type=float, default=0, help='mock server response delay in seconds')
+    resources.add_argument('--padding', type=int, default=0, help='mock server response padding in bytes')
+    resources.add_argument('--particles', type=int, default=2000, help='mock server particle count')
+    resources.add_argument('--keyframes', type=int, default=1000, help='keyframes per track in sequence payloads')
+    resources.set_defaults(function=benchmarkResources)
+
+    interpolation = commands.add_parser('interpolation', help='client side sampling of every sequence track')
+    interpolation.add_argument('--keyframes', type=int, default=500, help='keyframes per track')
+    interpolation.add_argument('--fps', type=int, default=60)
+    interpolation.add_argument('--length', type=float, default=40 * 60.0, help='replay length in seconds')
+    interpolation.add_argument('--seed', type=int, default=0)
+    interpolation.set_defaults(function=benchmarkInterpolation)
+
+    codecs = commands.add_parser('codec', help='json encode and decode speed of resource payloads')
+    codecs.add_argument('--iterations', type=int, default=50)
+    codecs.add_argument('--particles', type=int, default=5000, help='particle count of the particles payload')
+    codecs.add_argument('--keyframes', type=int, default=5000, help='keyframes per track in the sequence payload')
+    codecs.set_defaults(function=benchmarkCodecs)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+    args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
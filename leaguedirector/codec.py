@@ -0,0 +1,67 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec(object):
+    """
+    Standard library json, always available.
+    """
+    name = 'json'
+
+    def encode(self, data):
+        return json.dumps(data, separators=(',', ':')).encode()
+
+    def decode(self, buffer):
+        if not isinstance(buffer, (bytes, bytearray, str)):
+            buffer = bytes(buffer)
+        return json.loads(buffer)
+
+
+class OrjsonCodec(object):
+    """
+    orjson encodes straight to bytes and parses any buffer in place, so a
+    reply can be decoded without first copying it into a python string.
+    """
+    name = 'orjson'
+
+    def encode(self, data):
+        return orjson.dumps(data)
+
+    def decode(self, buffer):
+        return orjson.loads(memoryview(buffer))
+
+
+codecs = {'json': JsonCodec()}
+if orjson is not None:
+    codecs['orjson'] = OrjsonCodec()
+
+# Use the fastest backend that is installed unless told otherwise
+codec = codecs.get('orjson', codecs['json'])
+
+
+def setCodec(name):
+    global codec
+    if name in codecs:
+        codec = codecs[name]
+    else:
+        logging.warning('Unknown json codec %s, keeping %s', name, codec.name)
+
+
+def encode(data):
+    """
+    Serialize data to json bytes.
+    """
+    return codec.encode(data)
+
+
+def decode(buffer):
+    """
+    Parse json from bytes or any object exposing the buffer protocol, such
+    as the QByteArray of a network reply.
+    """
+    return codec.decode(buffer)
@@ -2,25 +2,66 @@ import os
 import psutil
 import platform
 import logging
+import threading
 import subprocess
 from PySide6.QtCore import *
 
-def findWindowsInstalled(paths):
+
+class System(object):
+    """
+    Everything game discovery asks of the operating system. The finders
+    below only go through this so a fake filesystem and process table can
+    stand in for the real machine.
+    """
+
+    def platform(self):
+        return platform.system()
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def mtime(self, path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def processes(self):
+        """
+        Name and executable path of every running process we may inspect.
+        """
+        for process in psutil.process_iter(attrs=['name', 'exe']):
+            if process.info['name'] and process.info['exe']:
+                yield process.info['name'], process.info['exe']
+
+    def registry(self, key):
+        settings = QSettings(key, QSettings.NativeFormat)
+        return {name: settings.value(name) for name in settings.allKeys()}
+
+    def spotlight(self, query):
+        return [line.decode() for line in subprocess.check_output(['mdfind', query]).splitlines()]
+
+    def replayApiEnabled(self, path):
+        settings = QSettings(path, QSettings.IniFormat)
+        value = settings.value('EnableReplayApi', False)
+        return str(value).lower() in ['true', '1']
+
+
+def findWindowsInstalled(paths, system):
     """
     Find games install in the windows registry.
     """
-    settings = QSettings('HKEY_CURRENT_USER\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Uninstall', QSettings.NativeFormat);
-    for key in settings.allKeys():
+    keys = system.registry('HKEY_CURRENT_USER\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Uninstall')
+    for key, value in keys.items():
         if key.startswith('Riot Game league_of_legends') and key.endswith('InstallLocation'):
-            paths.append(settings.value(key))
+            paths.append(value)
 
-def findWindowsRunning(paths):
+def findWindowsRunning(paths, system):
     """
     Find any running games on windows
     """
-    for process in psutil.process_iter(attrs=['name', 'exe']):
-        name = process.info['name'].lower()
-        path = process.info['exe']
+    for name, path in system.processes():
+        name = name.lower()
         if name == 'leagueclient.exe' and '\\RADS' in path:
             paths.append(path.split('\\RADS')[0])
         if name == 'leagueclient.exe' and '\\LeagueClient.exe' in path:
@@ -28,77 +69,173 @@ def findWindowsRunning(paths):
         elif name in ('launcher.exe', 'singleplayertool.exe') and 'DevRoot' in path:
             paths.append(os.path.join(path.split('\\DevRoot')[0], 'DevRoot'))
 
-def findWindowsCached(paths):
+def findWindowsCached(paths, system):
     """
     Search through the windows MUI cache which is another place windows
     will keep track of league of legends clients that have been started
     on this machine.
     """
-    settings = QSettings('HKEY_CURRENT_USER\\Software\\Classes\\Local Settings\\Software\\Microsoft\\Windows\\Shell\\MuiCache', QSettings.NativeFormat);
-    for key in settings.allKeys():
+    keys = system.registry('HKEY_CURRENT_USER\\Software\\Classes\\Local Settings\\Software\\Microsoft\\Windows\\Shell\\MuiCache')
+    for key in keys:
         index = key.lower().find('league of legends.exe')
         if index > 0:
             paths.append(key[0:index])
 
-def findMacInstalled(paths):
+def findMacInstalled(paths, system):
     """
     Ask the mac system profiler to list all installed apps.
     """
     query = 'kMDItemCFBundleIdentifier==com.riotgames.leagueoflegends'
-    for line in subprocess.check_output(['mdfind', query]).splitlines():
-        paths.append(line.decode())
+    paths.extend(system.spotlight(query))
 
-def findMacRunning(paths):
+def findMacRunning(paths, system):
     """
     List all the running league client processes.
     """
-    for process in psutil.process_iter(attrs=['name']):
-        if process.info['name'].lower() == 'leagueclient':
-            path = process.exe().split('/Contents/LoL/RADS/')
+    for name, exe in system.processes():
+        if name.lower() == 'leagueclient':
+            path = exe.split('/Contents/LoL/RADS/')
             if len(path) == 2:
                 paths.append(path[0])
 
-def findInstalledGames():
-    paths = []
-
-    # Find running games on windows
-    if platform.system() == 'Windows':
-        findWindowsInstalled(paths)
-        findWindowsRunning(paths)
-        findWindowsCached(paths)
-    elif platform.system() == 'Darwin':
-        findMacInstalled(paths)
-        findMacRunning(paths)
-    
-    # Make sure all paths are valid and formatted the same
-    paths = [configFilePath(os.path.abspath(path)) for path in paths]
-
-    # Remove nones + duplicates and sort
-    return sorted(list(set([os.path.normcase(path) for path in paths if path is not None])))
-
-def configFilePath(path):
+# Finders to run on each platform, cheapest first so results show up early
+finders = {
+    'Windows': [findWindowsInstalled, findWindowsCached, findWindowsRunning],
+    'Darwin': [findMacInstalled, findMacRunning],
+}
+
+def discoverGames(system=None):
+    """
+    Yield the game config of every install found, each one only once and
+    as soon as the finder that located it returns.
+    """
+    system = system or System()
+    seen = set()
+    for finder in finders.get(system.platform(), []):
+        paths = []
+        try:
+            finder(paths, system)
+        except Exception as error:
+            logging.warning('Game discovery with %s failed: %s', finder.__name__, error)
+        for path in paths:
+            # Make sure all paths are valid and formatted the same
+            config = configFilePath(path, system) if path else None
+            if config is not None:
+                config = os.path.normcase(config)
+                if config not in seen:
+                    seen.add(config)
+                    yield config
+
+def findInstalledGames(system=None):
+    return sorted(discoverGames(system))
+
+def configFilePath(path, system=None):
+    system = system or System()
     path = os.path.abspath(path)
-    if platform.system() == 'Darwin':
+    if system.platform() == 'Darwin':
         path = os.path.join(path, 'Contents', 'LoL')
     config = os.path.join(path, 'DATA', 'CFG', 'game.cfg')
-    if os.path.isfile(config):
+    if system.isfile(config):
         return config
     config = os.path.join(path, 'Config', 'game.cfg')
-    if os.path.isfile(config):
+    if system.isfile(config):
         return config
     config = os.path.join(path, 'Game', 'Config', 'game.cfg')
-    if os.path.isfile(config):
+    if system.isfile(config):
         return config
 
+
+class GameCache(object):
+    """
+    Remembers every game config that was discovered along with its replay
+    api state. A config is only parsed again once its modification time
+    changes, and is dropped once the file is gone.
+    """
+
+    def __init__(self, system=None):
+        self.system = system or System()
+        self.lock = threading.Lock()
+        self.games = {}
+
+    def paths(self):
+        with self.lock:
+            paths = sorted(self.games)
+        return [path for path in paths if self.enabled(path) is not None]
+
+    def enabled(self, path):
+        """
+        Replay api state of the config at path, None if it no longer exists.
+        """
+        mtime = self.system.mtime(path)
+        with self.lock:
+            if mtime is None:
+                self.games.pop(path, None)
+                return None
+            cached = self.games.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        enabled = self.system.replayApiEnabled(path)
+        with self.lock:
+            self.games[path] = (mtime, enabled)
+        return enabled
+
+    def retain(self, paths):
+        """
+        Forget games that were not found by the latest discovery.
+        """
+        with self.lock:
+            for path in set(self.games) - set(paths):
+                del self.games[path]
+
+    def invalidate(self, path):
+        with self.lock:
+            self.games.pop(path, None)
+
+
+cache = GameCache()
+
+
+class GameDiscovery(QThread):
+    """
+    Runs game discovery off the ui thread and reports every game as soon
+    as it is found. Emits done with all the paths found once every finder
+    has returned.
+    """
+    found = Signal(str, bool)
+    done = Signal(list)
+
+    def __init__(self, cache=cache, system=None):
+        QThread.__init__(self)
+        self.cache = cache
+        self.system = system or cache.system
+        self.running = True
+        QCoreApplication.instance().aboutToQuit.connect(self.stop)
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+    def run(self):
+        paths = []
+        for path in discoverGames(self.system):
+            if not self.running:
+                return
+            enabled = self.cache.enabled(path)
+            if enabled is not None:
+                paths.append(path)
+                self.found.emit(path, enabled)
+        self.cache.retain(paths)
+        self.done.emit(paths)
+
+
 def isGameEnabled(path):
-    if os.path.isfile(path):
-        settings = QSettings(path, QSettings.IniFormat)
-        value = settings.value('EnableReplayApi', False)
-        return str(value).lower() in ['true', '1']
-    return False
+    return bool(cache.enabled(path))
 
 def setGameEnabled(path, enabled):
     if os.path.isfile(path):
         logging.info('Setting EnableReplayApi %s=%d', path, enabled)
         settings = QSettings(path, QSettings.IniFormat)
         settings.setValue('EnableReplayApi', int(enabled))
+        settings.sync()
+        # The write may land within the resolution of the file timestamp
+        cache.invalidate(path)
@@ -0,0 +1,115 @@
+def freezeKeyframe(keyframe):
+    return tuple((key, tuple(value.items()) if isinstance(value, dict) else value) for key, value in keyframe.items())
+
+
+def thawKeyframe(keyframe):
+    return {key: dict(value) if isinstance(value, tuple) else value for key, value in keyframe}
+
+
+def freezeTrack(keyframes):
+    return tuple(freezeKeyframe(keyframe) for keyframe in keyframes)
+
+
+def thawTrack(keyframes):
+    return [thawKeyframe(keyframe) for keyframe in keyframes]
+
+
+class History(object):
+    """
+    Undo history of a sequence. Every entry maps each track to an immutable
+    copy of its keyframes, tracks that did not change between two entries
+    share the same copy. Recording or restoring an entry therefore only
+    costs as much as the tracks that differ.
+
+    The history is capped by the number of keyframes it holds, once the cap
+    is exceeded the oldest entries are dropped.
+    """
+
+    def __init__(self, limit=200000):
+        self.limit = limit
+        self.reset()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def reset(self):
+        self.entries = []
+        self.costs = []
+        self.index = 0
+        self.size = 0
+
+    def push(self, tracks, changed):
+        """
+        Record a new entry from tracks, a dict of keyframe lists, where only
+        the names in changed may differ from the current entry. Returns
+        False if nothing actually changed.
+        """
+        if not self.entries:
+            entry = {name: freezeTrack(keyframes) for name, keyframes in tracks.items()}
+            cost = sum(len(keyframes) for keyframes in entry.values())
+        else:
+            current = self.entries[self.index]
+            entry = dict(current)
+            cost = 0
+            for name in changed:
+                frozen = freezeTrack(tracks[name])
+                if frozen != current.get(name):
+                    entry[name] = frozen
+                    cost += len(frozen)
+            if all(entry[name] is current.get(name) for name in changed):
+                return False
+            self.truncate(self.index + 1)
+        self.entries.append(entry)
+        self.costs.append(cost)
+        self.size += cost
+        self.index = len(self.entries) - 1
+        self.evict()
+        return True
+
+    def backfill(self, name, keyframes):
+        """
+        Add a track that was left out of every entry so far because it was
+        not loaded yet. It cannot have changed before it was loaded, so all
+        those entries share one copy of it.
+        """
+        missing = [index for index, entry in enumerate(self.entries) if name not in entry]
+        if missing:
+            frozen = freezeTrack(keyframes)
+            for index in missing:
+                self.entries[index][name] = frozen
+            self.costs[missing[0]] += len(frozen)
+            self.size += len(frozen)
+            self.evict()
+
+    def truncate(self, length):
+        # Drop the redo branch, its tracks are only owned by those entries
+        for cost in self.costs[length:]:
+            self.size -= cost
+        del self.entries[length:]
+        del self.costs[length:]
+
+    def evict(self):
+        while self.size > self.limit and len(self.entries) > 1:
+            oldest = self.entries.pop(0)
+            self.size -= self.costs.pop(0)
+            # Tracks the next entry shared with the dropped one now belong to it
+            successor = self.entries[0]
+            for name, keyframes in successor.items():
+                if keyframes is oldest.get(name):
+                    self.costs[0] += len(keyframes)
+                    self.size += len(keyframes)
+            self.index = max(self.index - 1, 0)
+
+    def load(self, index):
+        """
+        Move to the entry at index and return the tracks that differ from
+        the current entry as fresh keyframe lists, or None if there is no
+        history to move through.
+        """
+        if not self.entries:
+            return None
+        index = max(min(index, len(self.entries) - 1), 0)
+        current = self.entries[self.index]
+        target = self.entries[index]
+        self.index = index
+        return {name: thawTrack(keyframes) for name, keyframes in target.items() if keyframes is not current.get(name)}
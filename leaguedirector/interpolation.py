@@ -0,0 +1,270 @@
+import math
+import bisect
+
+
+def linear(p):
+    return p
+
+def snap(p):
+    return 0.0 if p < 1 else 1.0
+
+def smoothStep(p):
+    return p * p * (3 - 2 * p)
+
+def smootherStep(p):
+    return p * p * p * (p * (p * 6 - 15) + 10)
+
+def quadraticEaseIn(p):
+    return p * p
+
+def quadraticEaseOut(p):
+    return -(p * (p - 2))
+
+def quadraticEaseInOut(p):
+    if p < 0.5:
+        return 2 * p * p
+    return (-2 * p * p) + (4 * p) - 1
+
+def cubicEaseIn(p):
+    return p * p * p
+
+def cubicEaseOut(p):
+    f = p - 1
+    return f * f * f + 1
+
+def cubicEaseInOut(p):
+    if p < 0.5:
+        return 4 * p * p * p
+    f = (2 * p) - 2
+    return 0.5 * f * f * f + 1
+
+def quarticEaseIn(p):
+    return p * p * p * p
+
+def quarticEaseOut(p):
+    f = p - 1
+    return f * f * f * (1 - p) + 1
+
+def quarticEaseInOut(p):
+    if p < 0.5:
+        return 8 * p * p * p * p
+    f = p - 1
+    return -8 * f * f * f * f + 1
+
+def quinticEaseIn(p):
+    return p * p * p * p * p
+
+def quinticEaseOut(p):
+    f = p - 1
+    return f * f * f * f * f + 1
+
+def quinticEaseInOut(p):
+    if p < 0.5:
+        return 16 * p * p * p * p * p
+    f = (2 * p) - 2
+    return 0.5 * f * f * f * f * f + 1
+
+def sineEaseIn(p):
+    return math.sin((p - 1) * math.pi / 2) + 1
+
+def sineEaseOut(p):
+    return math.sin(p * math.pi / 2)
+
+def sineEaseInOut(p):
+    return 0.5 * (1 - math.cos(p * math.pi))
+
+def circularEaseIn(p):
+    return 1 - math.sqrt(1 - p * p)
+
+def circularEaseOut(p):
+    return math.sqrt((2 - p) * p)
+
+def circularEaseInOut(p):
+    if p < 0.5:
+        return 0.5 * (1 - math.sqrt(1 - 4 * p * p))
+    return 0.5 * (math.sqrt(-((2 * p) - 3) * ((2 * p) - 1)) + 1)
+
+def exponentialEaseIn(p):
+    return p if p == 0.0 else math.pow(2, 10 * (p - 1))
+
+def exponentialEaseOut(p):
+    return p if p == 1.0 else 1 - math.pow(2, -10 * p)
+
+def exponentialEaseInOut(p):
+    if p == 0.0 or p == 1.0:
+        return p
+    if p < 0.5:
+        return 0.5 * math.pow(2, (20 * p) - 10)
+    return -0.5 * math.pow(2, (-20 * p) + 10) + 1
+
+def elasticEaseIn(p):
+    return math.sin(13 * math.pi / 2 * p) * math.pow(2, 10 * (p - 1))
+
+def elasticEaseOut(p):
+    return math.sin(-13 * math.pi / 2 * (p + 1)) * math.pow(2, -10 * p) + 1
+
+def elasticEaseInOut(p):
+    if p < 0.5:
+        return 0.5 * math.sin(13 * math.pi / 2 * (2 * p)) * math.pow(2, 10 * ((2 * p) - 1))
+    return 0.5 * (math.sin(-13 * math.pi / 2 * ((2 * p - 1) + 1)) * math.pow(2, -10 * (2 * p - 1)) + 2)
+
+def backEaseIn(p):
+    return p * p * p - p * math.sin(p * math.pi)
+
+def backEaseOut(p):
+    f = 1 - p
+    return 1 - (f * f * f - f * math.sin(f * math.pi))
+
+def backEaseInOut(p):
+    if p < 0.5:
+        f = 2 * p
+        return 0.5 * (f * f * f - f * math.sin(f * math.pi))
+    f = 1 - (2 * p - 1)
+    return 0.5 * (1 - (f * f * f - f * math.sin(f * math.pi))) + 0.5
+
+def bounceEaseIn(p):
+    return 1 - bounceEaseOut(1 - p)
+
+def bounceEaseOut(p):
+    if p < 4 / 11.0:
+        return (121 * p * p) / 16.0
+    elif p < 8 / 11.0:
+        return (363 / 40.0 * p * p) - (99 / 10.0 * p) + 17 / 5.0
+    elif p < 9 / 10.0:
+        return (4356 / 361.0 * p * p) - (35442 / 1805.0 * p) + 16061 / 1805.0
+    return (54 / 5.0 * p * p) - (513 / 25.0 * p) + 268 / 25.0
+
+def bounceEaseInOut(p):
+    if p < 0.5:
+        return 0.5 * bounceEaseIn(p * 2)
+    return 0.5 * bounceEaseOut(p * 2 - 1) + 0.5
+
+
+blendFunctions = {
+    'linear': linear,
+    'snap': snap,
+    'smoothStep': smoothStep,
+    'smootherStep': smootherStep,
+    'quadraticEaseIn': quadraticEaseIn,
+    'quadraticEaseOut': quadraticEaseOut,
+    'quadraticEaseInOut': quadraticEaseInOut,
+    'cubicEaseIn': cubicEaseIn,
+    'cubicEaseOut': cubicEaseOut,
+    'cubicEaseInOut': cubicEaseInOut,
+    'quarticEaseIn': quarticEaseIn,
+    'quarticEaseOut': quarticEaseOut,
+    'quarticEaseInOut': quarticEaseInOut,
+    'quinticEaseIn': quinticEaseIn,
+    'quinticEaseOut': quinticEaseOut,
+    'quinticEaseInOut': quinticEaseInOut,
+    'sineEaseIn': sineEaseIn,
+    'sineEaseOut': sineEaseOut,
+    'sineEaseInOut': sineEaseInOut,
+    'circularEaseIn': circularEaseIn,
+    'circularEaseOut': circularEaseOut,
+    'circularEaseInOut': circularEaseInOut,
+    'exponentialEaseIn': exponentialEaseIn,
+    'exponentialEaseOut': exponentialEaseOut,
+    'exponentialEaseInOut': exponentialEaseInOut,
+    'elasticEaseIn': elasticEaseIn,
+    'elasticEaseOut': elasticEaseOut,
+    'elasticEaseInOut': elasticEaseInOut,
+    'backEaseIn': backEaseIn,
+    'backEaseOut': backEaseOut,
+    'backEaseInOut': backEaseInOut,
+    'bounceEaseIn': bounceEaseIn,
+    'bounceEaseOut': bounceEaseOut,
+    'bounceEaseInOut': bounceEaseInOut,
+}
+
+
+def blend(name, p):
+    """
+    Eases p from 0 to 1 with the named blend function, unknown names
+    fall back to linear.
+    """
+    return blendFunctions.get(name, linear)(p)
+
+
+class Curve(object):
+    """
+    Samples a keyframe track the same way the game does. Every segment is
+    eased with the blend of the keyframe it starts at, bool values always
+    snap, and vector or color values are eased per component. Before the
+    first and after the last keyframe the curve holds its end values.
+
+    Keyframes are unpacked once up front so sampling large arrays of times
+    does not touch the keyframe dicts again.
+    """
+
+    def __init__(self, keyframes):
+        keyframes = sorted(keyframes, key=lambda item: item['time'])
+        self.times = [keyframe['time'] for keyframe in keyframes]
+        self.blends = [blendFunctions.get(keyframe.get('blend'), linear) for keyframe in keyframes]
+        self.components = None
+        self.snapping = False
+        values = [keyframe['value'] for keyframe in keyframes]
+        if values and isinstance(values[0], dict):
+            self.components = tuple(values[0])
+            self.values = [tuple(value[name] for name in self.components) for value in values]
+        else:
+            self.snapping = bool(values) and isinstance(values[0], bool)
+            self.values = values
+
+    def __len__(self):
+        return len(self.times)
+
+    def evaluate(self, time):
+        return self.sample([time])[0]
+
+    def sample(self, times):
+        """
+        Evaluates the curve at every time in times. Ascending times, which
+        is how previews and exports walk a track, are found with a moving
+        lower bound so the search only ever covers the remaining keys.
+        """
+        keys = self.times
+        values = self.values
+        blends = self.blends
+        components = self.components
+        count = len(keys)
+        results = []
+        if count == 0:
+            return [None] * len(times)
+        last = count - 1
+        lower = 0
+        previous = None
+        for time in times:
+            if previous is not None and time < previous:
+                lower = 0
+            previous = time
+            index = bisect.bisect_right(keys, time, lower) - 1
+            lower = max(index, 0)
+            if index < 0:
+                value = values[0]
+            elif index >= last:
+                value = values[last]
+            elif self.snapping:
+                value = values[index]
+            else:
+                start = keys[index]
+                span = keys[index + 1] - start
+                p = blends[index]((time - start) / span) if span > 0 else 1.0
+                a = values[index]
+                b = values[index + 1]
+                if components is None:
+                    value = a + (b - a) * p
+                else:
+                    value = tuple(x + (y - x) * p for x, y in zip(a, b))
+            if components is not None:
+                value = dict(zip(components, value))
+            results.append(value)
+        return results
+
+
+def evaluate(keyframes, time):
+    return Curve(keyframes).evaluate(time)
+
+
+def sample(keyframes, times):
+    return Curve(keyframes).sample(times)
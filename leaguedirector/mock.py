@@ -0,0 +1,223 @@
+import os
+import ssl
+import sys
+import copy
+import json
+import time
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from leaguedirector.api import Game, Render, Particles, Playback, Recording, Sequence
+from leaguedirector.enable import System
+
+
+class MockGame(object):
+    """
+    In memory state of a game client that is serving the replay api.
+    Playback and recording time advance with the wall clock just like
+    they would in a running replay.
+    """
+
+    def __init__(self, particles=0, length=1800.0):
+        self.lock = threading.Lock()
+        self.clock = time.time()
+        self.state = {
+            Game.url: dict(Game.fields, processID=os.getpid()),
+            Render.url: copy.deepcopy(Render.fields),
+            Particles.url: self.createParticles(particles),
+            Playback.url: dict(Playback.fields, length=length, speed=1.0, paused=True),
+            Recording.url: copy.deepcopy(Recording.fields),
+            Sequence.url: copy.deepcopy(Sequence.fields),
+        }
+
+    def createParticles(self, count):
+        champions = ['Ahri', 'Ezreal', 'Jinx', 'LeeSin', 'Lux', 'Thresh', 'Yasuo', 'Zed']
+        slots = ['BA', 'Q', 'W', 'E', 'R', 'Passive']
+        particles = {}
+        for index in range(count):
+            champion = champions[index % len(champions)]
+            slot = slots[(index // len(champions)) % len(slots)]
+            particles['{}_Base_{}_{:05}.troy'.format(champion, slot, index)] = True
+        return particles
+
+    def advance(self):
+        now = time.time()
+        elapsed = now - self.clock
+        self.clock = now
+        playback = self.state[Playback.url]
+        recording = self.state[Recording.url]
+        if not playback['paused']:
+            playback['time'] = min(playback['time'] + elapsed * playback['speed'], playback['length'])
+        if recording['recording']:
+            recording['currentTime'] = min(recording['currentTime'] + elapsed, recording['endTime'])
+            if recording['currentTime'] >= recording['endTime']:
+                recording['recording'] = False
+
+    def get(self, url):
+        with self.lock:
+            self.advance()
+            return copy.deepcopy(self.state[url])
+
+    def post(self, url, data):
+        with self.lock:
+            self.advance()
+            state = self.state[url]
+            for key, value in data.items():
+                if key in state or url in (Particles.url, Recording.url):
+                    state[key] = value
+            if url == Recording.url and data.get('recording'):
+                state['currentTime'] = state['startTime']
+            return copy.deepcopy(state)
+
+    def hasUrl(self, url):
+        return url in self.state
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.server.game.hasUrl(self.path):
+            self.respond(200, self.server.game.get(self.path))
+        else:
+            self.respond(404, {'errorCode': 'RESOURCE_NOT_FOUND', 'message': self.path})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            data = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as error:
+            self.respond(400, {'errorCode': 'BAD_REQUEST', 'message': str(error)})
+            return
+        if self.server.game.hasUrl(self.path):
+            self.respond(200, self.server.game.post(self.path, data))
+        else:
+            self.respond(404, {'errorCode': 'RESOURCE_NOT_FOUND', 'message': self.path})
+
+    def respond(self, status, data):
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        # Padding is plain whitespace so it inflates the payload without
+        # changing what the client decodes from it.
+        body = json.dumps(data).encode() + b' ' * self.server.padding
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('Mock %s', format % args)
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Serves a MockGame over http, or https when a certificate is given.
+    """
+    daemon_threads = True
+
+    def __init__(self, game=None, host='127.0.0.1', port=2999, delay=0, padding=0, certfile=None, keyfile=None):
+        ThreadingHTTPServer.__init__(self, (host, port), MockHandler)
+        self.game = game or MockGame()
+        self.delay = delay
+        self.padding = padding
+        self.scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = 'https'
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return '{}://{}:{}'.format(self.scheme, host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MockSystem(System):
+    """
+    Fake filesystem, process table, registry and spotlight index for game
+    discovery. Files map a game.cfg path to its replay api state. Defaults
+    to the mac layout since its paths work on any posix machine. Every
+    query sleeps for delay seconds to mimic a slow machine.
+    """
+
+    def __init__(self, platform='Darwin', files=None, processes=None, registry=None, spotlight=None, delay=0):
+        self.system = platform
+        self.files = dict(files or {})
+        self.mtimes = {path: 1.0 for path in self.files}
+        self.running = list(processes or [])
+        self.keys = dict(registry or {})
+        self.installed = list(spotlight or [])
+        self.delay = delay
+        self.reads = 0
+
+    def addGame(self, path, enabled=False):
+        self.files[path] = enabled
+        self.mtimes[path] = self.mtimes.get(path, 0.0) + 1.0
+
+    def removeGame(self, path):
+        self.files.pop(path, None)
+        self.mtimes.pop(path, None)
+
+    def platform(self):
+        return self.system
+
+    def isfile(self, path):
+        return path in self.files
+
+    def mtime(self, path):
+        return self.mtimes.get(path)
+
+    def processes(self):
+        time.sleep(self.delay)
+        return list(self.running)
+
+    def registry(self, key):
+        time.sleep(self.delay)
+        return dict(self.keys.get(key, {}))
+
+    def spotlight(self, query):
+        time.sleep(self.delay)
+        return list(self.installed)
+
+    def replayApiEnabled(self, path):
+        self.reads += 1
+        return self.files[path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a mock replay api for development and benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2999)
+    parser.add_argument('--delay', type=float, default=0, help='seconds to wait before each response')
+    parser.add_argument('--padding', type=int, default=0, help='extra bytes appended to each response')
+    parser.add_argument('--particles', type=int, default=500, help='number of particle emitters')
+    parser.add_argument('--length', type=float, default=1800.0, help='replay length in seconds')
+    parser.add_argument('--cert', help='certificate file to serve https')
+    parser.add_argument('--key', help='private key for the certificate')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)-8s] %(message)s')
+    game = MockGame(particles=args.particles, length=args.length)
+    server = MockServer(game, args.host, args.port, args.delay, args.padding, args.cert, args.key)
+    logging.info('Mock replay api listening on %s', server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import re
+import fnmatch
+
+
+def compilePatterns(patterns):
+    """
+    Combine patterns into one case insensitive expression. Patterns are
+    shell style globs, or regular expressions when prefixed with re:.
+    Returns None when there are no patterns.
+    """
+    expressions = []
+    for pattern in patterns:
+        if pattern.startswith('re:'):
+            expressions.append('.*?(?:{})'.format(pattern[3:]))
+        else:
+            expressions.append(fnmatch.translate(pattern))
+    if expressions:
+        return re.compile('|'.join(expressions), re.IGNORECASE)
+
+
+class ParticleRule(object):
+    """
+    Enables or disables every particle matching one of the include
+    patterns and none of the exclude patterns. Without include patterns
+    the rule covers every particle.
+    """
+
+    def __init__(self, include=(), exclude=(), enabled=False):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.enabled = enabled
+        self.includeExpression = compilePatterns(self.include)
+        self.excludeExpression = compilePatterns(self.exclude)
+
+    def matches(self, name):
+        if self.includeExpression is not None and not self.includeExpression.match(name):
+            return False
+        return self.excludeExpression is None or not self.excludeExpression.match(name)
+
+    def data(self):
+        return {'include': self.include, 'exclude': self.exclude, 'enabled': self.enabled}
+
+    @classmethod
+    def fromData(cls, data):
+        return cls(data.get('include', []), data.get('exclude', []), data.get('enabled', False))
+
+
+def evaluate(rules, names):
+    """
+    The state each rule assigns to the names it matches, when several
+    rules match the same particle the last one wins.
+    """
+    states = {}
+    for rule in rules:
+        for name in names:
+            if rule.matches(name):
+                states[name] = rule.enabled
+    return states
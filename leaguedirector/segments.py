@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import logging
+from PySide6.QtCore import *
+from leaguedirector.storage import atomicWrite
+
+
+def splitRange(startTime, endTime, length, fps):
+    """
+    Cut startTime..endTime into segments of about length seconds. Cuts are
+    placed on the frame grid so no frame is recorded twice or dropped
+    where two segments meet. A length of zero keeps the range whole.
+    """
+    if length <= 0 or fps <= 0:
+        return [(startTime, endTime)]
+    step = max(int(round(length * fps)), 1) / fps
+    segments = []
+    start = startTime
+    while endTime - start > 0.5 / fps:
+        segments.append((start, min(startTime + (len(segments) + 1) * step, endTime)))
+        start = segments[-1][1]
+    return segments or [(startTime, endTime)]
+
+
+def concatLine(path):
+    return "file '{}'".format(path.replace("'", "'\\''"))
+
+
+class SegmentedRecording(QObject):
+    """
+    Records a time range as a series of segments, one recording request
+    each. Finished segments are kept in a manifest next to them, starting
+    again with the same settings skips straight to the first unfinished
+    segment. A failed segment is retried on its own, so a hiccup late in a
+    long render only costs that segment.
+
+    Video segments are listed in a concat file that ffmpeg can join
+    without re-encoding: ffmpeg -f concat -safe 0 -i concat.txt -c copy
+    """
+    progressed = Signal()
+    finished = Signal()
+    failed = Signal(str)
+    manifestName = 'manifest.json'
+    concatName = 'concat.txt'
+    # Seconds a recording may stop short of its end time and still count
+    tolerance = 1.0
+
+    def __init__(self, api, output, codec, fps, startTime, endTime, length=0, lossless=False, retries=2, startTimeout=60, stallTimeout=60):
+        QObject.__init__(self)
+        self.recording = api.recording
+        self.playback = api.playback
+        self.output = output
+        self.codec = codec
+        self.fps = fps
+        self.startTime = startTime
+        self.endTime = endTime
+        self.length = length
+        self.lossless = lossless
+        self.retries = retries
+        self.startTimeout = startTimeout
+        self.stallTimeout = stallTimeout
+        self.segments = []
+        self.resumed = 0
+        self.current = None
+        self.progress = None
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.tick)
+
+    @property
+    def segmented(self):
+        return self.length > 0
+
+    @property
+    def active(self):
+        return self.current is not None
+
+    def settings(self):
+        return {
+            'codec': self.codec,
+            'fps': self.fps,
+            'startTime': self.startTime,
+            'endTime': self.endTime,
+            'segment': self.length,
+            'lossless': self.lossless,
+        }
+
+    def manifestPath(self):
+        return os.path.join(self.output, self.manifestName)
+
+    def concatPath(self):
+        return os.path.join(self.output, self.concatName)
+
+    def segmentPath(self, segment):
+        if self.segmented:
+            return os.path.join(self.output, 'segment-{:04}'.format(segment['index']))
+        return self.output
+
+    def loadManifest(self):
+        bounds = splitRange(self.startTime, self.endTime, self.length, self.fps)
+        self.segments = [
+            {'index': index, 'startTime': start, 'endTime': end, 'status': 'pending', 'path': None, 'attempts': 0}
+            for index, (start, end) in enumerate(bounds)
+        ]
+        self.resumed = 0
+        if self.segmented and os.path.isfile(self.manifestPath()):
+            try:
+                with open(self.manifestPath(), 'r') as f:
+                    manifest = json.load(f)
+            except ValueError:
+                logging.warning('Ignoring damaged recording manifest %s', self.manifestPath())
+                return
+            if manifest.get('settings') != self.settings():
+                logging.warning('Recording settings changed, starting %s over', self.output)
+                return
+            self.segments = manifest['segments']
+            self.resumed = sum(1 for segment in self.segments if segment['status'] == 'done')
+            if self.resumed:
+                logging.info('Resuming %s after %d of %d segments', self.output, self.resumed, len(self.segments))
+
+    def saveManifest(self):
+        if self.segmented:
+            atomicWrite(self.manifestPath(), json.dumps({
+                'version': 1,
+                'settings': self.settings(),
+                'segments': self.segments,
+                'concat': self.concatName,
+            }, indent=4))
+            if self.codec != 'png':
+                lines = ['ffconcat version 1.0']
+                lines += [concatLine(segment['path']) for segment in self.segments if segment['status'] == 'done']
+                atomicWrite(self.concatPath(), '\n'.join(lines) + '\n')
+
+    def start(self):
+        if not os.path.isdir(self.output):
+            os.makedirs(self.output)
+        self.loadManifest()
+        self.saveManifest()
+        self.timer.start(100)
+        self.nextSegment()
+
+    def stop(self):
+        self.timer.stop()
+        if self.current is not None and self.recording.recording:
+            self.recording.update({'recording': False})
+        self.current = None
+
+    def nextSegment(self):
+        pending = [segment for segment in self.segments if segment['status'] != 'done']
+        if not pending:
+            self.timer.stop()
+            self.current = None
+            self.finished.emit()
+            return
+        segment = self.current = pending[0]
+        segment['attempts'] += 1
+        path = self.segmentPath(segment)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.progress = None
+        self.requested = time.time()
+        self.playback.play()
+        self.recording.update({
+            'recording' : True,
+            'codec' : self.codec,
+            'startTime' : segment['startTime'],
+            'endTime' : segment['endTime'],
+            'framesPerSecond' : self.fps,
+            'enforceFrameRate' : True,
+            'lossless' : self.lossless,
+            'path' : path,
+        })
+
+    def tick(self):
+        segment = self.current
+        if segment is None:
+            return
+        recording = self.recording
+        if self.progress is None:
+            # Wait for the game to confirm this segment before trusting
+            # anything it reports about progress
+            if recording.recording and recording.startTime == segment['startTime'] and recording.endTime == segment['endTime']:
+                self.progress = (recording.currentTime, time.time())
+                self.started = time.time()
+                self.progressed.emit()
+            elif time.time() - self.requested > self.startTimeout:
+                self.retry('Recording did not start')
+            return
+        if recording.currentTime > self.progress[0]:
+            self.progress = (recording.currentTime, time.time())
+            self.progressed.emit()
+        endTime = segment['endTime']
+        tolerance = min(self.tolerance, (endTime - segment['startTime']) / 4)
+        if recording.currentTime >= endTime or (not recording.recording and self.progress[0] >= endTime - tolerance):
+            self.complete(segment)
+        elif not recording.recording:
+            self.retry('Recording stopped at {:.2f}s of {:.2f}s'.format(self.progress[0], endTime))
+        elif time.time() - self.progress[1] > self.stallTimeout:
+            self.retry('Recording stalled at {:.2f}s'.format(self.progress[0]))
+
+    def complete(self, segment):
+        segment['status'] = 'done'
+        segment['path'] = self.segmentFile(segment)
+        segment['duration'] = round(time.time() - self.started, 3)
+        self.saveManifest()
+        self.progressed.emit()
+        self.nextSegment()
+
+    def retry(self, error):
+        segment = self.current
+        if self.recording.recording:
+            self.recording.update({'recording': False})
+        if segment['attempts'] <= self.retries:
+            logging.warning('Segment %d failed, retrying: %s', segment['index'], error)
+            self.saveManifest()
+            self.nextSegment()
+        else:
+            self.timer.stop()
+            self.current = None
+            self.saveManifest()
+            self.failed.emit(error)
+
+    def segmentFile(self, segment):
+        """
+        The file the game wrote a segment to. Falls back on the newest file
+        in the segment directory when the game only reports the directory.
+        """
+        path = self.recording.path
+        if path and os.path.isfile(path):
+            return path
+        directory = self.segmentPath(segment)
+        files = [os.path.join(directory, name) for name in os.listdir(directory)]
+        files = [name for name in files if os.path.isfile(name)]
+        if files:
+            return max(files, key=os.path.getmtime)
+        return path or directory
+
+    def resumedTime(self):
+        """
+        Seconds of the range recorded by an earlier run.
+        """
+        return sum(segment['endTime'] - segment['startTime'] for segment in self.segments[:self.resumed])
+
+    @property
+    def currentTime(self):
+        """
+        Seconds of the range recorded so far, counting every finished
+        segment and the progress of the current one.
+        """
+        recorded = sum(segment['endTime'] - segment['startTime'] for segment in self.segments if segment['status'] == 'done')
+        if self.current is not None and self.progress is not None:
+            recorded += max(self.progress[0] - self.current['startTime'], 0)
+        return recorded
@@ -1,8 +1,9 @@
 import copy
+import bisect
 import threading
 import webbrowser
 import statistics
-from operator import attrgetter, methodcaller
+from operator import attrgetter
 from PySide6.QtGui import *
 from PySide6.QtCore import *
 from PySide6.QtWidgets import *
@@ -11,19 +12,32 @@ from leaguedirector.widgets import *
 PRECISION = 10000.0
 SNAPPING = 4
 OVERLAP = 4
+AGGREGATE = 8
 ADJACENT = 0.05
 
 
+def keyframePixmap(overlapping):
+    """
+    Keyframe pixmaps are loaded once and shared by every keyframe item.
+    """
+    name = 'kfoverlap.png' if overlapping else 'kfnormal.png'
+    pixmap = QPixmapCache.find(name)
+    if pixmap is None:
+        pixmap = QPixmap(respath(name))
+        QPixmapCache.insert(name, pixmap)
+    return pixmap
+
+
 class SequenceKeyframe(QGraphicsPixmapItem):
 
     def __init__(self, api, item, track):
-        self.pixmapNormal = QPixmap(respath('kfnormal.png'))
-        self.pixmapOverlap = QPixmap(respath('kfoverlap.png'))
-        QGraphicsPixmapItem.__init__(self, self.pixmapNormal, track)
+        QGraphicsPixmapItem.__init__(self, keyframePixmap(False), track)
         self.api = api
         self.track = track
         self.item = item
         self.duplicate = None
+        self.overlapping = False
+        self.track.keyframes[id(item)] = self
         self.setCursor(Qt.ArrowCursor)
         self.setShapeMode(QGraphicsPixmapItem.BoundingRectShape)
         flags = QGraphicsItem.ItemIgnoresTransformations
@@ -44,9 +58,7 @@ class SequenceKeyframe(QGraphicsPixmapItem):
     @time.setter
     def time(self, value):
         if self.item['time'] != value:
-            self.item['time'] = value
-            self.api.sequence.update()
-            self.track.updateOverlap()
+            self.track.moveKeyframe(self, value)
             self.update()
 
     @property
@@ -71,7 +83,7 @@ class SequenceKeyframe(QGraphicsPixmapItem):
     def value(self, value):
         if self.item['value'] != value:
             self.item['value'] = value
-            self.api.sequence.update()
+            self.api.sequence.update(self.track.name)
             self.update()
 
     @property
@@ -82,7 +94,7 @@ class SequenceKeyframe(QGraphicsPixmapItem):
     def blend(self, value):
         if self.item.get('blend') != value:
             self.item['blend'] = value
-            self.api.sequence.update()
+            self.api.sequence.update(self.track.name)
             self.update()
 
     def update(self):
@@ -96,11 +108,12 @@ class SequenceKeyframe(QGraphicsPixmapItem):
         return 'Time: {}\nBlend: {}\nValue: {}'.format(self.time, self.blend, value)
 
     def delete(self):
-        self.api.sequence.removeKeyframe(self.track.name, self.item)
-        self.scene().removeItem(self)
+        self.track.deleteKeyframe(self)
 
     def setOverlapping(self, overlapping):
-        self.setPixmap(self.pixmapOverlap if overlapping else self.pixmapNormal)
+        if self.overlapping != overlapping:
+            self.overlapping = overlapping
+            self.setPixmap(keyframePixmap(overlapping))
 
     def mouseDoubleClickEvent(self, event):
         if event.button() == Qt.LeftButton and event.modifiers() == Qt.NoModifier:
@@ -123,7 +136,8 @@ class SequenceKeyframe(QGraphicsPixmapItem):
             self.performDuplication()
             return value
         elif change == QGraphicsItem.ItemPositionHasChanged:
-            if value:
+            # Placing an item at its own keyframe is not an edit
+            if value and value.x() != int(self.time * PRECISION):
                 self.time = value.x() / PRECISION
         return QGraphicsPixmapItem.itemChange(self, change, value)
 
@@ -137,22 +151,26 @@ class SequenceKeyframe(QGraphicsPixmapItem):
         if QApplication.mouseButtons() == Qt.LeftButton:
             if QApplication.keyboardModifiers() == Qt.NoModifier:
                 if len(self.scene().selectedItems()) < 2:
-                    scene = self.scene()
                     viewport = self.viewport()
-                    screenPosition = viewport.mapFromScene(time, 0).x()
-                    left = viewport.mapToScene(screenPosition - SNAPPING, 0).x()
-                    right = viewport.mapToScene(screenPosition + SNAPPING, 0).x()
-                    items = scene.items(left, float(0), right - left, scene.height(), Qt.IntersectsItemBoundingRect, Qt.AscendingOrder)
-                    for item in items:
-                        if isinstance(item, SequenceKeyframe):
-                            if item != self and not item.isSelected() and item.track != self.track:
-                                return item.x()
-                        elif isinstance(item, SequenceTime):
-                            return self.api.playback.time * PRECISION
+                    distance = SNAPPING / max(viewport.transform().m11() * PRECISION, 1e-9)
+                    target = time / PRECISION
+                    candidates = []
+                    nearest = viewport.nearestKeyframe(target, distance, self.track)
+                    if nearest is not None:
+                        candidates.append(nearest['time'])
+                    if abs(self.api.playback.time - target) < distance:
+                        candidates.append(self.api.playback.time)
+                    if candidates:
+                        return int(min(candidates, key=lambda value: abs(value - target)) * PRECISION)
         return time
 
 
 class SequenceTrack(QGraphicsRectItem):
+    """
+    Only keyframes inside the visible time range get an item, plus any
+    that are selected. When more keyframes are visible than there is room
+    to tell them apart, the track draws them as aggregate markers instead.
+    """
     height = 22
 
     def __init__(self, api, name, index):
@@ -160,12 +178,13 @@ class SequenceTrack(QGraphicsRectItem):
         self.api = api
         self.name = name
         self.index = index
+        self.keyframes = {}
+        self.aggregated = False
+        self.distance = None
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
         self.setPos(0, self.height * self.index)
         self.setToolTip(self.api.sequence.getLabel(self.name))
         self.setPen(QPen(QColor(70, 70, 70, 255)))
-        self.updateOverlapTimer = QTimer()
-        self.updateOverlapTimer.timeout.connect(self.updateOverlapNow)
-        self.updateOverlapTimer.setSingleShot(True)
         self.gradient = QLinearGradient(QPointF(0, 0), QPointF(120 * PRECISION, 0))
         self.gradient.setColorAt(0, QColor(30, 30, 30, 255))
         self.gradient.setColorAt(0.49999999999999, QColor(30, 30, 30, 255))
@@ -173,55 +192,151 @@ class SequenceTrack(QGraphicsRectItem):
         self.gradient.setColorAt(1, QColor(40, 40, 40, 255))
         self.gradient.setSpread(QGradient.RepeatSpread)
         self.setBrush(QBrush(self.gradient))
-        self.reload()
         self.update()
 
     def viewport(self):
         return self.scene().views()[0]
 
-    def paint(self, *args):
-        self.updateOverlap()
-        return QGraphicsRectItem.paint(self, *args)
+    def paint(self, painter, option, widget=None):
+        # Only fill what is exposed, the track spans the whole replay
+        exposed = option.exposedRect.intersected(self.rect())
+        painter.fillRect(exposed, self.brush())
+        painter.setPen(self.pen())
+        painter.drawLine(QLineF(exposed.left(), 0, exposed.right(), 0))
+        painter.drawLine(QLineF(exposed.left(), self.height, exposed.right(), self.height))
+        if self.aggregated:
+            self.paintAggregates(painter, exposed)
+
+    def paintAggregates(self, painter, exposed):
+        """
+        Draw one marker per cluster of keyframes that would overlap on
+        screen, walking the sorted keyframe times so the cost depends on
+        the number of markers and not the number of keyframes.
+        """
+        times = self.api.sequence.getKeyframes(self.name).times
+        transform = painter.worldTransform()
+        scale = transform.m11() * PRECISION
+        distance = AGGREGATE / max(scale, 1e-9)
+        index = bisect.bisect_left(times, exposed.left() / PRECISION - distance)
+        stop = bisect.bisect_right(times, exposed.right() / PRECISION + distance)
+        single = keyframePixmap(False)
+        cluster = keyframePixmap(True)
+        y = transform.dy() + 3
+        painter.save()
+        painter.resetTransform()
+        while index < stop:
+            following = bisect.bisect_right(times, times[index] + distance, index, stop)
+            x = times[index] * scale + transform.dx() - 10
+            painter.drawPixmap(QPointF(x, y), cluster if following - index > 1 else single)
+            index = following
+        painter.restore()
+
+    def visibleKeyframes(self):
+        start, end = self.viewport().visibleRange()
+        return self.api.sequence.getKeyframes(self.name).between(start, end)
+
+    def cull(self):
+        """
+        Create items for the keyframes in view and drop the ones that
+        scrolled out of it.
+        """
+        if self.scene() is None:
+            return
+        visible = self.visibleKeyframes()
+        aggregated = len(visible) * OVERLAP > self.viewport().viewport().width()
+        wanted = set() if aggregated else set(id(item) for item in visible)
+        for key, keyframe in list(self.keyframes.items()):
+            if key not in wanted and not keyframe.isSelected():
+                self.removeKeyframeItem(keyframe)
+        # Overlap depends on the zoom, only a zoom change needs a full pass
+        distance = self.overlapDistance()
+        if distance != self.distance:
+            self.distance = distance
+            self.updateOverlap(keyframe.item for keyframe in list(self.keyframes.values()))
+        if not aggregated:
+            for item in visible:
+                self.keyframeItem(item)
+        if aggregated != self.aggregated:
+            self.aggregated = aggregated
+            QGraphicsRectItem.update(self)
+        elif aggregated:
+            QGraphicsRectItem.update(self)
+
+    def keyframeItem(self, item):
+        keyframe = self.keyframes.get(id(item))
+        if keyframe is None:
+            keyframe = SequenceKeyframe(self.api, item, self)
+            self.updateOverlap([item])
+        return keyframe
+
+    def keyframeItems(self):
+        return [self.keyframeItem(item) for item in self.api.sequence.getKeyframes(self.name)]
+
+    def removeKeyframeItem(self, keyframe):
+        self.keyframes.pop(id(keyframe.item), None)
+        if keyframe.scene() is not None:
+            keyframe.scene().removeItem(keyframe)
 
     def reload(self):
-        for item in self.childItems():
-            if isinstance(item, SequenceKeyframe):
-                self.scene().removeItem(item)
-        for item in self.api.sequence.getKeyframes(self.name):
-            SequenceKeyframe(self.api, item, self)
+        for keyframe in list(self.keyframes.values()):
+            self.removeKeyframeItem(keyframe)
+        self.cull()
 
     def addKeyframe(self):
         item = self.api.sequence.createKeyframe(self.name)
-        return SequenceKeyframe(self.api, item, self)
+        return self.insertedKeyframe(item)
 
     def duplicateKeyframe(self, keyframe):
         item = copy.deepcopy(keyframe.item)
         self.api.sequence.appendKeyframe(self.name, item)
-        return SequenceKeyframe(self.api, item, self)
+        return self.insertedKeyframe(item)
+
+    def insertedKeyframe(self, item):
+        keyframe = self.keyframeItem(item)
+        self.updateOverlap(self.api.sequence.getKeyframes(self.name).neighbours(item) + [item])
+        return keyframe
+
+    def moveKeyframe(self, keyframe, time):
+        keyframes = self.api.sequence.getKeyframes(self.name)
+        affected = keyframes.neighbours(keyframe.item)
+        self.api.sequence.moveKeyframe(self.name, keyframe.item, time)
+        self.updateOverlap(affected + keyframes.neighbours(keyframe.item) + [keyframe.item])
+
+    def deleteKeyframe(self, keyframe):
+        neighbours = self.api.sequence.getKeyframes(self.name).neighbours(keyframe.item)
+        self.api.sequence.removeKeyframe(self.name, keyframe.item)
+        self.removeKeyframeItem(keyframe)
+        self.updateOverlap(neighbours)
 
     def clearKeyframes(self):
-        for item in self.childItems():
-            if isinstance(item, SequenceKeyframe):
-                item.delete()
-
-    def updateOverlapNow(self):
-        viewport = self.viewport()
-        distance = viewport.mapToScene(OVERLAP, 0).x() - viewport.mapToScene(0, 0).x()
-        previous = None
-        for child in sorted(self.childItems(), key=methodcaller('x')):
-            if isinstance(child, SequenceKeyframe):
-                if previous and abs(child.x() - previous.x()) < distance:
-                    child.setOverlapping(True)
-                    previous.setOverlapping(True)
-                else:
-                    child.setOverlapping(False)
-                previous = child
-
-    def updateOverlap(self):
-        self.updateOverlapTimer.start(100)
+        self.api.sequence.clearKeyframes(self.name)
+        self.reload()
+
+    def overlapDistance(self):
+        """
+        Time between two keyframes below which their markers overlap at the
+        current zoom level.
+        """
+        return OVERLAP / max(self.viewport().transform().m11() * PRECISION, 1e-9)
+
+    def updateOverlap(self, items):
+        """
+        Refresh the overlap marker of the given keyframes, each one only
+        looks at its direct neighbours in the sorted track.
+        """
+        if self.scene() is None:
+            return
+        keyframes = self.api.sequence.getKeyframes(self.name)
+        distance = self.overlapDistance()
+        for item in items:
+            keyframe = self.keyframes.get(id(item))
+            if keyframe is not None:
+                keyframe.setOverlapping(keyframes.overlaps(item, distance))
 
     def update(self):
-        self.setRect(0, 0, int(self.api.playback.length * PRECISION), self.height)
+        rect = QRectF(0, 0, int(self.api.playback.length * PRECISION), self.height)
+        if rect != self.rect():
+            self.setRect(rect)
 
 
 class SequenceHeader(QGraphicsRectItem):
@@ -280,6 +395,9 @@ class SequenceTrackView(QGraphicsView):
         QGraphicsView.__init__(self, self.scene)
         self.tracks = {}
         self.timer = schedule(10, self.animate)
+        self.cullTimer = QTimer()
+        self.cullTimer.timeout.connect(self.cullNow)
+        self.cullTimer.setSingleShot(True)
         self.scale(1.0 / PRECISION, 1.0)
         self.setDragMode(QGraphicsView.NoDrag)
         self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
@@ -293,34 +411,70 @@ class SequenceTrackView(QGraphicsView):
         self.time.setPen(QPen(QApplication.palette().highlight(), 1))
         self.time.setFlags(QGraphicsItem.ItemIgnoresTransformations)
         self.scene.addItem(self.time)
-        self.api.playback.updated.connect(self.update)
-        self.api.sequence.updated.connect(self.update)
+        self.api.playback.fieldsChanged.connect(self.updateFields)
         self.api.sequence.dataLoaded.connect(self.reload)
         headers.addKeyframe.connect(self.addKeyframe)
         headers.verticalScrollBar().valueChanged.connect(lambda value: self.verticalScrollBar().setValue(value))
         self.verticalScrollBar().valueChanged.connect(lambda value: headers.verticalScrollBar().setValue(value))
         self.scene.selectionChanged.connect(self.selectionChanged.emit)
+        self.horizontalScrollBar().valueChanged.connect(self.cull)
+        self.reload()
 
     def reload(self):
         for track in self.tracks.values():
             track.reload()
 
+    def visibleRange(self):
+        """
+        Time range on screen, widened by a screen on either side so
+        keyframes are already there when scrolling.
+        """
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        margin = rect.width()
+        return (rect.left() - margin) / PRECISION, (rect.right() + margin) / PRECISION
+
+    def cullNow(self):
+        for track in self.tracks.values():
+            track.cull()
+
+    def cull(self):
+        self.cullTimer.start(0)
+
     def selectedKeyframes(self):
         return [key for key in self.scene.selectedItems() if isinstance(key, SequenceKeyframe)]
 
     def allKeyframes(self):
-        return [key for key in self.scene.items() if isinstance(key, SequenceKeyframe)]
+        keyframes = []
+        for track in self.tracks.values():
+            keyframes.extend(track.keyframeItems())
+        return keyframes
+
+    def nearestKeyframe(self, time, distance, exclude=None):
+        """
+        Closest keyframe to time on any track but exclude that is less than
+        distance away, or None.
+        """
+        nearest = None
+        for track in self.tracks.values():
+            if track is not exclude:
+                item = self.api.sequence.getKeyframes(track.name).nearest(time)
+                if item is not None and abs(item['time'] - time) < distance:
+                    if nearest is None or abs(item['time'] - time) < abs(nearest['time'] - time):
+                        nearest = item
+        return nearest
 
     def addKeyframe(self, name):
         self.tracks[name].addKeyframe()
 
     def clearKeyframes(self):
-        for track in self.tracks.values():
-            track.clearKeyframes()
+        with self.api.sequence.transaction():
+            for track in self.tracks.values():
+                track.clearKeyframes()
 
     def deleteSelectedKeyframes(self):
-        for selected in self.selectedKeyframes():
-            selected.delete()
+        with self.api.sequence.transaction():
+            for selected in self.selectedKeyframes():
+                selected.delete()
 
     def selectAllKeyframes(self):
         for child in self.allKeyframes():
@@ -328,18 +482,19 @@ class SequenceTrackView(QGraphicsView):
 
     def selectAdjacentKeyframes(self):
         for selected in self.selectedKeyframes():
-            for child in self.allKeyframes():
-                if abs(child.time - selected.time) < ADJACENT:
-                    child.setSelected(True)
+            for track in self.tracks.values():
+                keyframes = self.api.sequence.getKeyframes(track.name)
+                for item in keyframes.between(selected.time - ADJACENT, selected.time + ADJACENT):
+                    if abs(item['time'] - selected.time) < ADJACENT:
+                        track.keyframeItem(item).setSelected(True)
 
     def selectNextKeyframe(self):
         selectionSorted = sorted(self.selectedKeyframes(), key=attrgetter('time'))
         trackSelection = {key.track : key for key in selectionSorted}
         for track, selected in trackSelection.items():
-            for child in sorted(track.childItems(), key=attrgetter('time')):
-                if child.time > selected.time:
-                    trackSelection[track] = child
-                    break
+            item = self.api.sequence.getKeyframes(track.name).after(selected.time)
+            if item is not None:
+                trackSelection[track] = track.keyframeItem(item)
         self.scene.clearSelection()
         for item in trackSelection.values():
             item.setSelected(True)
@@ -348,10 +503,9 @@ class SequenceTrackView(QGraphicsView):
         selectionSorted = sorted(self.selectedKeyframes(), key=attrgetter('time'), reverse=True)
         trackSelection = {key.track : key for key in selectionSorted}
         for track, selected in trackSelection.items():
-            for child in sorted(track.childItems(), key=attrgetter('time'), reverse=True):
-                if child.time < selected.time:
-                    trackSelection[track] = child
-                    break
+            item = self.api.sequence.getKeyframes(track.name).before(selected.time)
+            if item is not None:
+                trackSelection[track] = track.keyframeItem(item)
         self.scene.clearSelection()
         for item in trackSelection.values():
             item.setSelected(True)
@@ -365,6 +519,11 @@ class SequenceTrackView(QGraphicsView):
         for track in self.tracks.values():
             track.update()
 
+    def updateFields(self, names):
+        # Tracks span the replay, nothing else needs them redrawn
+        if 'length' in names:
+            self.update()
+
     def mousePressEvent(self, event):
         if event.button() == Qt.RightButton:
             self.setDragMode(QGraphicsView.ScrollHandDrag)
@@ -381,6 +540,11 @@ class SequenceTrackView(QGraphicsView):
                 QGraphicsView.mousePressEvent(self, event)
         QGraphicsView.mousePressEvent(self, event)
 
+    def mouseMoveEvent(self, event):
+        # Dragging a selection moves every selected keyframe at once
+        with self.api.sequence.transaction():
+            QGraphicsView.mouseMoveEvent(self, event)
+
     def mouseDoubleClickEvent(self, event):
         QGraphicsView.mouseDoubleClickEvent(self, event)
         if not self.scene.selectedItems() and not event.isAccepted():
@@ -395,6 +559,11 @@ class SequenceTrackView(QGraphicsView):
             self.scale(1.1, 1.0)
         else:
             self.scale(0.9, 1.0)
+        self.cull()
+
+    def resizeEvent(self, event):
+        QGraphicsView.resizeEvent(self, event)
+        self.cull()
 
     def animate(self):
         self.time.setPos(self.api.playback.currentTime * PRECISION, 0)
@@ -528,13 +697,16 @@ class SequenceSelectedView(QWidget):
             self.valueColor.setVisible(False)
 
     def updateTime(self):
-        for item in self.tracks.selectedKeyframes():
-            item.time = self.time.value()
+        with self.api.sequence.transaction():
+            for item in self.tracks.selectedKeyframes():
+                item.time = self.time.value()
 
     def updateValue(self, value):
-        for item in self.tracks.selectedKeyframes():
-            item.value = value
+        with self.api.sequence.transaction():
+            for item in self.tracks.selectedKeyframes():
+                item.value = value
 
     def updateBlend(self, index):
-        for item in self.tracks.selectedKeyframes():
-            item.blend = self.blend.itemText(index)
+        with self.api.sequence.transaction():
+            for item in self.tracks.selectedKeyframes():
+                item.blend = self.blend.itemText(index)
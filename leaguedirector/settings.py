@@ -1,24 +1,51 @@
 import os
+import copy
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from leaguedirector.widgets import userpath
+from leaguedirector.storage import atomicWrite
 
 class Settings(object):
+    """
+    Values are only kept in memory when set, flush() writes them out in
+    one go on a worker thread and only if something actually changed.
+    """
 
     def __init__(self):
         self.data = {}
+        self.dirty = False
         self.path = userpath('config.json')
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.written = None
         self.loadFile()
 
     def value(self, key, default=None):
         return self.data.get(key, default)
 
     def setValue(self, key, value):
-        self.data[key] = value
-        self.saveFile()
+        # Copy so later changes to a mutable value are still noticed
+        value = copy.deepcopy(value)
+        if self.data.get(key) != value:
+            self.data[key] = value
+            self.dirty = True
 
-    def saveFile(self):
-        with open(self.path, 'w') as f:
-            json.dump(self.data, f, sort_keys=True, indent=4)
+    def flush(self, wait=False):
+        """
+        With wait, also wait for a write submitted by an earlier flush.
+        """
+        if self.dirty:
+            self.dirty = False
+            contents = json.dumps(self.data, sort_keys=True, indent=4)
+            self.written = self.writer.submit(self.saveFile, contents)
+        if wait and self.written is not None:
+            self.written.result()
+
+    def saveFile(self, contents):
+        try:
+            atomicWrite(self.path, contents)
+        except OSError as error:
+            logging.error('Failed to save settings: {}'.format(error))
 
     def loadFile(self):
         if os.path.isfile(self.path):
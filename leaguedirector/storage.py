@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import logging
+import tempfile
+
+
+def atomicWrite(path, data):
+    """
+    Write data to path through a temporary file in the same directory that
+    is renamed over the original, so readers only ever see the old or the
+    new contents and never a partial write.
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    handle, temp = tempfile.mkstemp(prefix='.' + filename, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+class Journal(object):
+    """
+    Append only log of edits kept next to a snapshot file. Every entry is
+    one line of json mapping track names to their new keyframes. A crash
+    can at worst leave a torn last line, which is skipped when replaying.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def append(self, tracks):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(tracks, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replay(self):
+        entries = []
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        logging.warning('Skipping damaged journal entry in %s', self.path)
+        return entries
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+BINARY_MAGIC = b'LDSQ'
+BINARY_VERSION = 1
+NO_BLEND = 255
+
+# Column layouts a track can be stored in, tracks that do not fit one of
+# them exactly are kept as a json blob so the format stays lossless
+FLOAT, BOOL, VECTOR, COLOR, RAW = range(5)
+COMPONENTS = {
+    FLOAT: (),
+    BOOL: (),
+    VECTOR: ('x', 'y', 'z'),
+    COLOR: ('r', 'g', 'b', 'a'),
+}
+
+
+def trackKind(keyframes):
+    kind = None
+    for keyframe in keyframes:
+        if set(keyframe) - {'time', 'value', 'blend'} or 'value' not in keyframe:
+            return RAW
+        if type(keyframe.get('time')) is not float:
+            return RAW
+        if 'blend' in keyframe and not isinstance(keyframe['blend'], str):
+            return RAW
+        value = keyframe['value']
+        if type(value) is bool:
+            current = BOOL
+        elif type(value) is float:
+            current = FLOAT
+        elif type(value) is dict and all(type(v) is float for v in value.values()):
+            if tuple(value) == COMPONENTS[VECTOR]:
+                current = VECTOR
+            elif tuple(value) == COMPONENTS[COLOR]:
+                current = COLOR
+            else:
+                return RAW
+        else:
+            return RAW
+        if kind is not None and kind != current:
+            return RAW
+        kind = current
+    return FLOAT if kind is None else kind
+
+
+def littleEndian(column):
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def padding(size):
+    return b'\0' * (-size % 8)
+
+
+def encodeTrack(keyframes, blendIds):
+    kind = trackKind(keyframes)
+    if kind != RAW:
+        for keyframe in keyframes:
+            if 'blend' in keyframe and keyframe['blend'] not in blendIds:
+                if len(blendIds) >= NO_BLEND:
+                    kind = RAW
+                    break
+                blendIds[keyframe['blend']] = len(blendIds)
+    if kind == RAW:
+        return kind, json.dumps(keyframes, separators=(',', ':')).encode()
+    components = COMPONENTS[kind]
+    times = array.array('d', (keyframe['time'] for keyframe in keyframes))
+    if components:
+        values = array.array('d', (keyframe['value'][name] for keyframe in keyframes for name in components))
+    else:
+        values = array.array('d', (keyframe['value'] for keyframe in keyframes))
+    blends = bytes(blendIds.get(keyframe.get('blend'), NO_BLEND) if 'blend' in keyframe else NO_BLEND for keyframe in keyframes)
+    return kind, littleEndian(times).tobytes() + littleEndian(values).tobytes() + blends
+
+
+def writeBinary(path, tracks):
+    """
+    Write tracks in the columnar sequence format. Each track is stored as a
+    column of times, a column of value components and a column of interned
+    blend ids, every section starts 8 byte aligned so the columns can be
+    read straight out of a memory map.
+    """
+    blendIds = {}
+    encoded = []
+    for name, keyframes in tracks.items():
+        kind, payload = encodeTrack(keyframes, blendIds)
+        try:
+            bounds = (min(k['time'] for k in keyframes), max(k['time'] for k in keyframes)) if keyframes else (0.0, 0.0)
+        except (KeyError, TypeError):
+            bounds = (float('nan'), float('nan'))
+        encoded.append((name.encode(), kind, len(keyframes), bounds, payload))
+    blends = sorted(blendIds, key=blendIds.get)
+
+    header = struct.pack('<4sHHHH', BINARY_MAGIC, BINARY_VERSION, len(encoded), len(blends), 0)
+    header += b''.join(struct.pack('<H', len(blend.encode())) + blend.encode() for blend in blends)
+    tableSize = sum(struct.calcsize('<H') + len(name) + struct.calcsize('<BIddQQ') for name, *_ in encoded)
+    offset = len(header) + tableSize
+    offset += len(padding(offset))
+    table = b''
+    sections = b''
+    for name, kind, count, bounds, payload in encoded:
+        table += struct.pack('<H', len(name)) + name
+        table += struct.pack('<BIddQQ', kind, count, bounds[0], bounds[1], offset + len(sections), len(payload))
+        sections += payload + padding(len(payload))
+    contents = header + table
+    atomicWrite(path, contents + padding(len(contents)) + sections)
+
+
+class BinarySequence(object):
+    """
+    Memory mapped reader for files written by writeBinary. Only the track
+    table is parsed up front, keyframes are decoded one track at a time
+    when they are asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, trackCount, blendCount, _ = struct.unpack_from('<4sHHHH', self.data, 0)
+        if magic != BINARY_MAGIC or version > BINARY_VERSION:
+            self.close()
+            raise ValueError('Not a sequence file: {}'.format(path))
+        position = struct.calcsize('<4sHHHH')
+        self.blends = []
+        for _ in range(blendCount):
+            length, = struct.unpack_from('<H', self.data, position)
+            position += 2
+            self.blends.append(self.data[position:position + length].decode())
+            position += length
+        self.tracks = {}
+        for _ in range(trackCount):
+            length, = struct.unpack_from('<H', self.data, position)
+            position += 2
+            name = self.data[position:position + length].decode()
+            position += length
+            self.tracks[name] = struct.unpack_from('<BIddQQ', self.data, position)
+            position += struct.calcsize('<BIddQQ')
+
+    def names(self):
+        return list(self.tracks)
+
+    def count(self, name):
+        return self.tracks[name][1]
+
+    def bounds(self, name):
+        """
+        Earliest and latest keyframe time of a track without decoding it,
+        None for an empty track.
+        """
+        kind, count, start, end, offset, length = self.tracks[name]
+        if count:
+            return start, end
+
+    def track(self, name):
+        kind, count, start, end, offset, length = self.tracks[name]
+        if kind == RAW:
+            return json.loads(self.data[offset:offset + length])
+        components = COMPONENTS[kind]
+        width = max(len(components), 1)
+        times = array.array('d')
+        times.frombytes(self.data[offset:offset + count * 8])
+        offset += count * 8
+        values = array.array('d')
+        values.frombytes(self.data[offset:offset + count * width * 8])
+        offset += count * width * 8
+        blends = self.data[offset:offset + count]
+        littleEndian(times)
+        littleEndian(values)
+        keyframes = []
+        for index in range(count):
+            if components:
+                value = dict(zip(components, values[index * width:(index + 1) * width]))
+            elif kind == BOOL:
+                value = values[index] != 0
+            else:
+                value = values[index]
+            keyframe = {'time': times[index], 'value': value}
+            if blends[index] != NO_BLEND:
+                keyframe['blend'] = self.blends[blends[index]]
+            keyframes.append(keyframe)
+        return keyframes
+
+    def read(self):
+        return {name: self.track(name) for name in self.tracks}
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,109 @@
+import time
+import logging
+import collections
+from leaguedirector.widgets import userpath
+from leaguedirector.storage import Journal
+
+
+class RenderTelemetry(object):
+    """
+    Samples how far a render got against the wall clock. The rate is taken
+    over the last few seconds only, so the estimate follows the render when
+    it speeds up or slows down. Every finished render is summarized as one
+    json line, which is what to compare codec and fps settings by.
+    """
+    window = 10.0
+
+    def __init__(self, path=None):
+        self.path = path or userpath('logs', 'renders.jsonl')
+        self.settings = None
+        self.samples = collections.deque()
+        self.started = None
+
+    @property
+    def active(self):
+        return self.settings is not None
+
+    def start(self, codec, fps, startTime, endTime, lossless=False, width=0, height=0, resumed=0, **extra):
+        """
+        Resumed is how many seconds of the range were already rendered
+        earlier, they do not count towards the speed of this render.
+        """
+        self.settings = dict(extra, codec=codec, fps=fps, startTime=startTime, endTime=endTime, lossless=lossless, width=width, height=height, resumed=resumed)
+        self.samples.clear()
+        self.started = time.time()
+
+    def sample(self, currentTime, now=None):
+        now = now or time.time()
+        self.samples.append((now, currentTime))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+            self.samples.popleft()
+
+    @property
+    def currentTime(self):
+        if self.samples:
+            return self.samples[-1][1]
+        return self.settings['startTime']
+
+    def realtime(self):
+        """
+        Seconds of video rendered per second of wall clock, None until
+        progress has been seen.
+        """
+        if len(self.samples) >= 2:
+            (start, first), (end, last) = self.samples[0], self.samples[-1]
+            if end > start and last > first:
+                return (last - first) / (end - start)
+
+    def framesPerSecond(self):
+        realtime = self.realtime()
+        if realtime is not None:
+            return realtime * self.settings['fps']
+
+    def remaining(self):
+        """
+        Estimated wall clock seconds until the render reaches its end time.
+        """
+        realtime = self.realtime()
+        if realtime:
+            return max(self.settings['endTime'] - self.currentTime, 0) / realtime
+
+    def finish(self, status='done', **updates):
+        """
+        Log a summary of the render and append it to the telemetry file.
+        Updates replace settings that were only known once rendering began.
+        """
+        if self.settings is None:
+            return None
+        self.settings.update(updates)
+        elapsed = time.time() - self.started
+        rendered = max(self.currentTime - self.settings['startTime'], 0)
+        if status == 'done':
+            rendered = self.settings['endTime'] - self.settings['startTime']
+        rendered = max(rendered - self.settings['resumed'], 0)
+        summary = dict(self.settings, status=status, timestamp=time.time())
+        summary['video'] = round(rendered, 3)
+        summary['frames'] = int(rendered * self.settings['fps'])
+        summary['wall'] = round(elapsed, 3)
+        summary['realtime'] = round(rendered / elapsed, 4) if elapsed > 0 else None
+        summary['framesPerSecond'] = round(summary['frames'] / elapsed, 2) if elapsed > 0 else None
+        logging.info(
+            'Render %s: %.1fs of %s %dx%d at %s fps in %.1fs, %.2fx realtime, %.1f frames/s',
+            status, rendered, summary['codec'], summary['width'], summary['height'],
+            summary['fps'], elapsed, summary['realtime'] or 0, summary['framesPerSecond'] or 0,
+        )
+        try:
+            Journal(self.path).append(summary)
+        except OSError as error:
+            logging.error('Failed to save render telemetry: {}'.format(error))
+        self.settings = None
+        self.samples.clear()
+        return summary
+
+
+def formatDuration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{}:{:02}:{:02}'.format(hours, minutes, seconds)
+    return '{:02}:{:02}'.format(minutes, seconds)
@@ -0,0 +1,152 @@
+import bisect
+
+
+class Track(list):
+    """
+    Keyframe list that is always ordered by time. A parallel list of the
+    keyframe times is kept alongside so lookups by time, range queries and
+    the first and last time are answered by bisection instead of a scan.
+
+    Keyframes are plain dicts shared with the rest of the application, so a
+    keyframe's time must be changed through move() for the order to hold.
+    It is still a list, anything that serializes or iterates keyframes keeps
+    working unchanged.
+    """
+
+    def __init__(self, keyframes=()):
+        list.__init__(self, sorted(keyframes, key=lambda item: item['time']))
+        self.times = [keyframe['time'] for keyframe in self]
+
+    @property
+    def start(self):
+        return self.times[0] if self.times else None
+
+    @property
+    def end(self):
+        return self.times[-1] if self.times else None
+
+    def append(self, keyframe):
+        """
+        Insert keyframe at its place in time, after any keyframes sharing
+        the same time, and return its index.
+        """
+        index = bisect.bisect_right(self.times, keyframe['time'])
+        self.times.insert(index, keyframe['time'])
+        list.insert(self, index, keyframe)
+        return index
+
+    def insert(self, index, keyframe):
+        # The position is always decided by the keyframe time
+        return self.append(keyframe)
+
+    def extend(self, keyframes):
+        for keyframe in keyframes:
+            self.append(keyframe)
+
+    def indexOf(self, keyframe):
+        """
+        Index of this exact keyframe object, keyframes are compared by
+        identity so two keyframes with equal contents are never confused.
+        """
+        lower = bisect.bisect_left(self.times, keyframe['time'])
+        upper = bisect.bisect_right(self.times, keyframe['time'])
+        for index in range(lower, upper):
+            if self[index] is keyframe:
+                return index
+        # The time was changed behind our back, fall back to a scan
+        for index, item in enumerate(self):
+            if item is keyframe:
+                return index
+        raise ValueError('Keyframe is not in track')
+
+    def remove(self, keyframe):
+        self.pop(self.indexOf(keyframe))
+
+    def pop(self, index=-1):
+        del self.times[index]
+        return list.pop(self, index)
+
+    def clear(self):
+        self.times.clear()
+        list.clear(self)
+
+    def move(self, keyframe, time):
+        """
+        Change the time of keyframe and move it to its new place.
+        """
+        index = self.indexOf(keyframe)
+        list.pop(self, index)
+        del self.times[index]
+        keyframe['time'] = time
+        self.append(keyframe)
+
+    def sort(self, key=None, reverse=False):
+        list.sort(self, key=lambda item: item['time'])
+        self.times = [keyframe['time'] for keyframe in self]
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self.sort()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        del self.times[index]
+
+    def __iadd__(self, keyframes):
+        self.extend(keyframes)
+        return self
+
+    def __reduce_ex__(self, protocol):
+        # Rebuild from the keyframes alone, copying the times as well and
+        # then appending the keyframes would list every time twice
+        return (Track, (list(self),))
+
+    def neighbours(self, keyframe):
+        """
+        The keyframes directly before and after keyframe that exist.
+        """
+        index = self.indexOf(keyframe)
+        return [self[i] for i in (index - 1, index + 1) if 0 <= i < len(self)]
+
+    def overlaps(self, keyframe, distance):
+        """
+        True if another keyframe is less than distance away in time.
+        """
+        index = self.indexOf(keyframe)
+        times = self.times
+        if index > 0 and times[index] - times[index - 1] < distance:
+            return True
+        return index + 1 < len(times) and times[index + 1] - times[index] < distance
+
+    def between(self, start, end):
+        """
+        Keyframes with start <= time <= end.
+        """
+        lower = bisect.bisect_left(self.times, start)
+        upper = bisect.bisect_right(self.times, end)
+        return self[lower:upper]
+
+    def after(self, time):
+        """
+        First keyframe strictly after time, or None.
+        """
+        index = bisect.bisect_right(self.times, time)
+        if index < len(self.times):
+            return self[index]
+
+    def before(self, time):
+        """
+        Last keyframe strictly before time, or None.
+        """
+        index = bisect.bisect_left(self.times, time)
+        if index > 0:
+            return self[index - 1]
+
+    def nearest(self, time):
+        """
+        Keyframe closest to time, or None for an empty track.
+        """
+        index = bisect.bisect_left(self.times, time)
+        candidates = [i for i in (index - 1, index) if 0 <= i < len(self.times)]
+        if candidates:
+            return self[min(candidates, key=lambda i: abs(self.times[i] - time))]